@@ -0,0 +1,101 @@
+"""Compare render time and PDF size with and without stream compression.
+
+Renders the same invoices uncompressed, with reportlab's default settings
+(Flate compressed and ASCII85 encoded) and with compress=True (Flate only),
+reporting the time per invoice and the average PDF size of each mode.
+
+Usage: python benchmarks/bench_compression.py [-N 200] [--engine platypus]
+                                              [--lines 0]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_generator  # noqa: E402
+
+from bench_engines import SAMPLE_CONFIG  # noqa: E402
+from bench_line_items import make_items  # noqa: E402
+
+MODES = ("uncompressed", "default", "compressed")
+
+
+def time_mode(profile, engine, count, items, mode):
+    from reportlab import rl_config
+
+    saved = rl_config.pageCompression
+    rl_config.pageCompression = 0 if mode == "uncompressed" else saved
+    compress = mode == "compressed"
+    try:
+        # Warm up so styles and fonts are built before timing starts
+        invoice_generator.build_invoice(
+            profile, "warmup", "2024-01-01", 1, engine, io.BytesIO(), compress=compress
+        )
+        size = 0
+        start = time.perf_counter()
+        for number in range(count):
+            buffer = io.BytesIO()
+            invoice_generator.build_invoice(
+                profile,
+                number,
+                "2024-01-01",
+                None if items else 10 + number % 10,
+                engine,
+                buffer,
+                items,
+                compress=compress,
+            )
+            size += len(buffer.getvalue())
+        elapsed = time.perf_counter() - start
+    finally:
+        rl_config.pageCompression = saved
+    return elapsed / count, size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-N", "--count", type=int, default=200, help="Invoices per mode"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=invoice_generator.ENGINES,
+        default="platypus",
+        help="Rendering engine",
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=0,
+        help="Line items per invoice (default: a single row billed by units)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(SAMPLE_CONFIG, f)
+        profile = invoice_generator.load_profile(config_file)
+        items = make_items(args.lines) if args.lines else None
+
+        results = {
+            mode: time_mode(profile, args.engine, args.count, items, mode)
+            for mode in MODES
+        }
+
+    baseline_size = results["uncompressed"][1]
+    for mode, (seconds, size) in results.items():
+        print(
+            f"{mode:>12}: {seconds * 1000:8.3f} ms/invoice  "
+            f"{size:10.0f} bytes/invoice  {size / baseline_size:6.1%} of uncompressed"
+        )
+
+
+if __name__ == "__main__":
+    main()
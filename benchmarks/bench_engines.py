@@ -0,0 +1,76 @@
+"""Compare per-invoice render time of the rendering engines.
+
+Usage: python benchmarks/bench_engines.py [-c config.json] [-N 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_generator  # noqa: E402
+
+SAMPLE_CONFIG = {
+    "company_name": "Example Consulting Ltd",
+    "company_address": ["1 High Street", "London", "EC1A 1AA"],
+    "bank_details": [
+        "Bank Name: XYZ Bank",
+        "Account Number: 123456789",
+        "SWIFT Code: XYZ123",
+    ],
+    "client_name": "Client Name",
+    "client_address": ["Line 1 of Client Address", "Line 2 of Client Address"],
+    "rate": 650,
+    "currency": "GBP",
+    "unit_of_work": "DAILY",
+    "include_vat": True,
+}
+
+
+def time_engine(profile, engine, count):
+    # Warm up so styles, fonts and profiles are built before timing starts
+    invoice_generator.build_invoice(profile, "warmup", "2024-01-01", 1, engine=engine)
+    start = time.perf_counter()
+    for number in range(count):
+        invoice_generator.build_invoice(
+            profile, number, "2024-01-01", 10 + number % 10, engine=engine
+        )
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--config", help="Config file (default: built-in sample)")
+    parser.add_argument(
+        "-N", "--count", type=int, default=200, help="Invoices per engine"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = args.config and os.path.abspath(args.config)
+        if config_file is None:
+            config_file = os.path.join(tmp, "config.json")
+            with open(config_file, "w") as f:
+                json.dump(SAMPLE_CONFIG, f)
+        profile = invoice_generator.load_profile(config_file)
+
+        os.chdir(tmp)
+        results = {
+            engine: time_engine(profile, engine, args.count)
+            for engine in invoice_generator.ENGINES
+        }
+
+    baseline = results["platypus"]
+    for engine, seconds in results.items():
+        print(
+            f"{engine:>10}: {seconds * 1000:8.3f} ms/invoice  "
+            f"{1 / seconds:8.1f} invoices/sec  {baseline / seconds:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure render time of invoices with many line items.
+
+Renders one invoice per size with that many line items (mixed VAT) and
+reports the time taken, the time per line and the number of pages, so that
+the cost per line can be checked to stay flat as invoices grow.
+
+Usage: python benchmarks/bench_line_items.py [--lines 100 1000 10000]
+                                             [--engine platypus]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_generator  # noqa: E402
+
+from bench_engines import SAMPLE_CONFIG  # noqa: E402
+
+
+def make_items(count):
+    return [
+        {
+            "description": f"API usage, batch {number}",
+            "units": 1 + number % 9,
+            "rate": 0.75,
+            "vat": number % 3 == 0,
+        }
+        for number in range(count)
+    ]
+
+
+def time_invoice(profile, engine, items):
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    invoice_generator.build_invoice(
+        profile, "bench", "2024-01-01", None, engine, buffer, items
+    )
+    elapsed = time.perf_counter() - start
+    # Every page starts with an uncompressed /Type /Page object
+    pages = buffer.getvalue().count(b"/Type /Page\n")
+    return elapsed, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--lines",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="Line item counts to render",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=invoice_generator.ENGINES,
+        default="platypus",
+        help="Rendering engine (multi-page invoices always use platypus)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(SAMPLE_CONFIG, f)
+        profile = invoice_generator.load_profile(config_file)
+
+        # Warm up so styles and fonts are built before timing starts
+        time_invoice(profile, args.engine, make_items(1))
+        for count in args.lines:
+            elapsed, pages = time_invoice(profile, args.engine, make_items(count))
+            print(
+                f"{count:>7} lines: {elapsed:8.3f} s  "
+                f"{elapsed / count * 1000:7.3f} ms/line  {pages:5d} pages"
+            )
+
+
+if __name__ == "__main__":
+    main()
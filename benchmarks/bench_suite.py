@@ -0,0 +1,193 @@
+"""Benchmark invoice rendering throughput and latency across configurations.
+
+Renders N invoices for each scenario (every unit of work with and without
+VAT, plus long addresses and a multi-page invoice of line items) and reports
+invoices/sec, p50/p95/p99 latency, mean PDF size and peak RSS. Use --json to
+save the results for comparison between versions.
+
+Usage: python benchmarks/bench_suite.py [-N 200] [--engine canvas]
+                                        [--json out.json] [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reportlab  # noqa: E402
+
+import invoice_generator  # noqa: E402
+
+BASE_CONFIG = {
+    "company_name": "Example Consulting Ltd",
+    "company_address": ["1 High Street", "London", "EC1A 1AA"],
+    "bank_details": [
+        "Bank Name: XYZ Bank",
+        "Account Number: 123456789",
+        "SWIFT Code: XYZ123",
+    ],
+    "client_name": "Client Name",
+    "client_address": ["Line 1 of Client Address", "Line 2 of Client Address"],
+    "rate": 650,
+    "currency": "GBP",
+}
+
+LONG_ADDRESS = [
+    "Unit 14, The Old Brewery Business Park, Long Industrial Estate Road",
+    "Little Snoring on the Marsh, Near Great Snoring",
+    "North Norfolk District",
+    "NR21 0AA",
+    "United Kingdom",
+]
+
+
+# Line items of the line-items scenario, enough to run over three pages
+LINE_ITEMS = [
+    {
+        "description": f"Support ticket #{number}",
+        "units": 0.5 + number % 4,
+        "vat": number % 2 == 0,
+    }
+    for number in range(120)
+]
+
+
+def scenarios():
+    # Yields (name, config, items); items is None for single-row invoices
+    for unit in invoice_generator.UNIT_HEADERS:
+        for include_vat in (False, True):
+            name = f"{unit.lower()}-{'vat' if include_vat else 'novat'}"
+            config = dict(BASE_CONFIG, unit_of_work=unit, include_vat=include_vat)
+            yield name, config, None
+    yield "long-addresses", dict(
+        BASE_CONFIG,
+        company_address=LONG_ADDRESS,
+        client_address=LONG_ADDRESS,
+        include_vat=True,
+    ), None
+    yield "line-items", BASE_CONFIG, LINE_ITEMS
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_scenario(config_file, engine, count, items=None):
+    # Warm up so styles and the config profile are built before timing
+    invoice_generator.render_invoice(
+        config_file, 0, "2024-01-01", 1, engine=engine, items=items
+    )
+
+    latencies = []
+    total_bytes = 0
+    start = time.perf_counter()
+    for number in range(count):
+        t0 = time.perf_counter()
+        data = invoice_generator.render_invoice(
+            config_file,
+            number,
+            "2024-01-01",
+            1 + number % 40,
+            engine=engine,
+            items=items,
+        )
+        latencies.append(time.perf_counter() - t0)
+        total_bytes += len(data)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "invoices": count,
+        "invoices_per_sec": round(count / elapsed, 1),
+        "latency_ms": {
+            name: round(invoice_generator.percentile(latencies, pct) * 1000, 3)
+            for name, pct in (("p50", 50), ("p95", 95), ("p99", 99))
+        },
+        "bytes_per_pdf": total_bytes // count,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def compare(result, previous):
+    if previous is None:
+        return ""
+    change = result["invoices_per_sec"] / previous["invoices_per_sec"] - 1
+    return f"  {change:+.1%} vs baseline"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-N", "--count", type=int, default=200, help="Invoices per scenario"
+    )
+    parser.add_argument(
+        "--engine",
+        action="append",
+        choices=invoice_generator.ENGINES,
+        help="Engine to benchmark; may be repeated (default: all engines)",
+    )
+    parser.add_argument(
+        "--scenario", action="append", help="Only run the named scenario(s)"
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON")
+    parser.add_argument(
+        "--compare",
+        metavar="PATH",
+        help="Compare throughput against results previously saved with --json",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for result in json.load(f)["results"]:
+                baseline[result["scenario"], result["engine"]] = result
+
+    engines = args.engine or list(invoice_generator.ENGINES)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, config, items in scenarios():
+            if args.scenario and name not in args.scenario:
+                continue
+            config_file = os.path.join(tmp, f"{name}.json")
+            with open(config_file, "w") as f:
+                json.dump(config, f)
+            for engine in engines:
+                result = run_scenario(config_file, engine, args.count, items)
+                result.update(scenario=name, engine=engine)
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{name:>16} {engine:>9}: "
+                    f"{result['invoices_per_sec']:8.1f}/s  "
+                    f"p50 {latency['p50']:7.3f}ms  "
+                    f"p95 {latency['p95']:7.3f}ms  "
+                    f"p99 {latency['p99']:7.3f}ms  "
+                    f"{result['bytes_per_pdf']:6d} B/pdf  "
+                    f"rss {result['peak_rss_kb'] // 1024} MB"
+                    + compare(result, baseline.get((name, engine)))
+                )
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "reportlab": reportlab.Version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure the throughput of exact line-item totals.
+
+Computes subtotal, VAT and total over N line items three ways: the float
+arithmetic invoices used to use, the exact per-line integer arithmetic
+(line_amount) and batch_totals, which uses numpy when it is installed. Also
+reports how many lines the float version gets wrong by a penny or more.
+
+Usage: python benchmarks/bench_totals.py [-N 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_generator  # noqa: E402
+
+
+def make_lines(count):
+    # Quantities with up to two decimals and rates with up to four
+    rng = random.Random(0)
+    units = [rng.randint(1, 100000) / 100 for _ in range(count)]
+    rates = [rng.randint(1, 2000000) / 10000 for _ in range(count)]
+    vat = [rng.random() < 0.5 for _ in range(count)]
+    return units, rates, vat
+
+
+def float_totals(units, rates, vat):
+    amounts = []
+    subtotal = vat_total = 0.0
+    for quantity, rate, with_vat in zip(units, rates, vat):
+        amount = quantity * rate
+        vat_amount = amount * 0.2 if with_vat else 0.0
+        amounts.append(round(amount, 2))
+        subtotal += amount
+        vat_total += vat_amount
+    return amounts, (subtotal, vat_total, subtotal + vat_total)
+
+
+def exact_totals(units, rates, vat):
+    amounts = []
+    subtotal = vat_total = 0
+    for quantity, rate, with_vat in zip(units, rates, vat):
+        amount, vat_amount = invoice_generator.line_amount(quantity, rate, with_vat)
+        amounts.append(amount)
+        subtotal += amount
+        vat_total += vat_amount
+    return amounts, (subtotal, vat_total, subtotal + vat_total)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-N", "--count", type=int, default=1000000, help="Number of line items"
+    )
+    args = parser.parse_args()
+
+    units, rates, vat = make_lines(args.count)
+    to_fixed = invoice_generator.to_fixed
+    elapsed, (fixed_units, fixed_rates) = timed(
+        lambda: (
+            [to_fixed(u, invoice_generator.UNIT_SCALE) for u in units],
+            [to_fixed(r, invoice_generator.RATE_SCALE) for r in rates],
+        )
+    )
+    print(f"{'to_fixed conversion':>22}: {elapsed:7.3f} s")
+
+    float_time, (float_amounts, _) = timed(float_totals, units, rates, vat)
+    exact_time, (exact_amounts, exact) = timed(
+        exact_totals, fixed_units, fixed_rates, vat
+    )
+    batch_time, (_, _, batch) = timed(
+        invoice_generator.batch_totals, fixed_units, fixed_rates, vat
+    )
+    assert batch == exact
+
+    for name, seconds in (
+        ("float", float_time),
+        ("exact per line", exact_time),
+        ("batch_totals", batch_time),
+    ):
+        print(
+            f"{name:>22}: {seconds:7.3f} s  "
+            f"{args.count / seconds / 1e6:6.2f} M lines/sec"
+        )
+
+    wrong = sum(
+        round(amount * 100) != exact_amount
+        for amount, exact_amount in zip(float_amounts, exact_amounts)
+    )
+    print(f"float amounts off by a penny or more: {wrong} of {args.count}")
+
+
+if __name__ == "__main__":
+    main()
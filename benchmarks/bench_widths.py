@@ -0,0 +1,99 @@
+"""Compare text width measurement with and without the precomputed tables.
+
+Times reportlab's stringWidth against text_width on long address and
+line-item description strings in both layout fonts, then the column sizing
+of a large line-item table, measuring every cell as the canvas engines do and
+only the cells that could widen their column as platypus does.
+
+Usage: python benchmarks/bench_widths.py [-N 200000] [--lines 10000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_generator  # noqa: E402
+
+SAMPLE_TEXT = [
+    "Unit 4, The Old Brewery, 123 Long Industrial Estate Road, Manchester",
+    "Billed to: Example International Holdings Ltd, Finance Department",
+    "Platform engineering and on-call support, week 27 (Mon-Fri)",
+    "API usage, batch 1234: 1,250,000 requests at £0.0004 each",
+    "Amount Due: £12,345.67",
+]
+
+
+def time_measure(measure, count):
+    start = time.perf_counter()
+    for number in range(count):
+        text = SAMPLE_TEXT[number % len(SAMPLE_TEXT)]
+        measure(text, invoice_generator.LAYOUT_FONTS[number % 2], 10)
+    return (time.perf_counter() - start) / count
+
+
+def time_columns(size_columns, rows, count=5):
+    headers = ["Description", "Units", "Rate", "Amount", "VAT (20%)", "Total Amount"]
+    start = time.perf_counter()
+    for _ in range(count):
+        size_columns(headers, rows)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-N", "--count", type=int, default=200000, help="Strings to measure"
+    )
+    parser.add_argument(
+        "--lines", type=int, default=10000, help="Rows of the line-item table"
+    )
+    args = parser.parse_args()
+
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    # Build the tables and reportlab's font objects before timing starts
+    for font_name in invoice_generator.LAYOUT_FONTS:
+        invoice_generator.text_width("warm up", font_name, 10)
+        stringWidth("warm up", font_name, 10)
+
+    results = {
+        "stringWidth": time_measure(stringWidth, args.count),
+        "text_width": time_measure(invoice_generator.text_width, args.count),
+    }
+    baseline = results["stringWidth"]
+    for name, seconds in results.items():
+        print(
+            f"{name:>12}: {seconds * 1e6:7.3f} us/string  "
+            f"{baseline / seconds:5.1f}x"
+        )
+
+    rows = [
+        [
+            f"{SAMPLE_TEXT[number % 4][:40]} {number}",
+            str(1 + number % 9),
+            "£0.75",
+            "£6.75",
+            "£1.35",
+            "£8.10",
+        ]
+        for number in range(args.lines)
+    ]
+    sizers = {
+        "all cells": invoice_generator._column_widths,
+        "widening": lambda headers, rows: invoice_generator._table_widths(
+            headers, rows, "£"
+        ),
+    }
+    for name, size_columns in sizers.items():
+        seconds = time_columns(size_columns, rows)
+        print(
+            f"{name:>12}: {seconds * 1000:8.2f} ms for {args.lines} rows  "
+            f"{seconds / args.lines / 6 * 1e6:6.3f} us/cell"
+        )
+
+
+if __name__ == "__main__":
+    main()
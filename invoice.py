@@ -0,0 +1,8 @@
+# Command-line entry point for invoice_generator.py. Python caches the
+# compiled bytecode of imported modules in __pycache__ but recompiles the
+# script it is given on every run, so calling the generator through this
+# launcher skips compiling the whole module each time.
+from invoice_generator import main
+
+if __name__ == "__main__":
+    main()
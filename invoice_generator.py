@@ -1,11 +1,20 @@
 import argparse
+import array
+import contextlib
+import datetime
+import decimal
+import functools
+import hashlib
+import io
 import json
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_RIGHT, TA_LEFT
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.platypus.flowables import HRFlowable
+import math
+import operator
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
 
 
 def get_currency_symbol(currency):
@@ -16,87 +25,1341 @@ def get_currency_symbol(currency):
     }
     return currency_symbols.get(currency, '$')  # Default to $ if currency not found
 
-def generate_invoice(config_file, invoice_number, date, hours):
+# Column headers for each supported unit of work
+UNIT_HEADERS = {
+    "HOURLY": ("Number of Hours", "Hourly Rate"),
+    "DAILY": ("Number of Days", "Daily Rate"),
+    "WEEKLY": ("Number of Weeks", "Weekly Rate"),
+    "MONTHLY": ("Number of Months", "Monthly Rate"),
+}
+
+# Config fields that have no default
+REQUIRED_FIELDS = (
+    "company_name",
+    "company_address",
+    "bank_details",
+    "client_name",
+    "client_address",
+    "rate",
+)
+
+# VAT charged on line items that include it
+VAT_PERCENT = 20
+
+# Description of the single line item generated from a number of units
+DEFAULT_DESCRIPTION = "Consulting Services"
+
+# Fonts and size of the line-item table cells (Table's defaults)
+TABLE_FONT = "Helvetica"
+TABLE_BOLD_FONT = "Helvetica-Bold"
+TABLE_FONT_SIZE = 10
+TABLE_LEADING = 12
+# BOTTOMPADDING of the line-item header row
+TABLE_HEADER_PADDING = 12
+
+# Invoice numbers reserved at a time by each process using --auto-number, and
+# so the largest gap a crashed process can leave in the sequence
+NUMBER_BLOCK_SIZE = 32
+
+# How --auto-number formats allocated numbers
+NUMBER_FORMAT = "{:03d}"
+
+# Maximum number of parsed configs kept by load_profile
+PROFILE_CACHE_SIZE = 64
+
+# Part of every RenderCache key: bump it whenever a change to this file alters
+# the PDFs it produces, so that stale renders are not served from the cache
+RENDERER_VERSION = 1
+
+# Default bounds of a RenderCache: total size of the PDFs kept, and how long
+# an entry may go unused before it is evicted
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Rendering engines accepted by build_invoice
+ENGINES = ("platypus", "canvas", "overlay")
+
+# Fonts used by the canvas engine, in the order they are registered
+LAYOUT_FONTS = ("Helvetica", "Helvetica-Bold")
+
+# reportlab is imported by the functions that render, so that validation and
+# --help never pay for it. Its letter page size and inch unit, in points:
+PAGE_SIZE = PAGE_WIDTH, PAGE_HEIGHT = (612.0, 792.0)
+inch = 72.0
+
+# Page geometry of SimpleDocTemplate's default one inch margins, used by the
+# canvas engine to reproduce the platypus layout
+DOC_LEFT = inch
+DOC_WIDTH = PAGE_WIDTH - 2 * inch
+FRAME_LEFT = DOC_LEFT + 6
+FRAME_WIDTH = DOC_WIDTH - 12
+FRAME_TOP = PAGE_HEIGHT - inch - 6
+FRAME_BOTTOM = inch + 6
+CELL_HPADDING = 6
+CELL_VPADDING = 3
+
+# Dark blue for title and amount due
+DEFAULT_ACCENT_COLOR = (0, 0.3, 0.5)
+
+# Rendering phases in the order they run, used to order timing reports
+PHASES = ("config", "styles", "totals", "flowables", "layout", "draw", "build")
+
+
+class PhaseTimings:
+    # Wall-clock and CPU seconds spent in each rendering phase, accumulated
+    # over every invoice rendered while timing is enabled
+
+    def __init__(self):
+        # phase name -> [calls, wall seconds, cpu seconds]
+        self.phases = {}
+
+    def add(self, name, calls, wall, cpu):
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [calls, wall, cpu]
+        else:
+            entry[0] += calls
+            entry[1] += wall
+            entry[2] += cpu
+
+    def merge(self, phases):
+        # Fold in the phases dict of another PhaseTimings, e.g. from a worker
+        for name, (calls, wall, cpu) in phases.items():
+            self.add(name, calls, wall, cpu)
+
+    def _ordered(self):
+        order = {name: index for index, name in enumerate(PHASES)}
+        return sorted(
+            self.phases.items(), key=lambda item: order.get(item[0], len(order))
+        )
+
+    def as_dict(self):
+        return {
+            name: {"calls": calls, "wall_s": wall, "cpu_s": cpu}
+            for name, (calls, wall, cpu) in self._ordered()
+        }
+
+    def format_table(self):
+        lines = [
+            f"{'Phase':<10} {'Calls':>7} {'Wall (ms)':>11} {'CPU (ms)':>11} "
+            f"{'ms/call':>9}"
+        ]
+        total_wall = total_cpu = 0.0
+        for name, (calls, wall, cpu) in self._ordered():
+            total_wall += wall
+            total_cpu += cpu
+            lines.append(
+                f"{name:<10} {calls:>7} {wall * 1000:>11.1f} {cpu * 1000:>11.1f} "
+                f"{wall * 1000 / calls:>9.3f}"
+            )
+        lines.append(
+            f"{'total':<10} {'':>7} {total_wall * 1000:>11.1f} "
+            f"{total_cpu * 1000:>11.1f}"
+        )
+        return "\n".join(lines)
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "wall", "cpu")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(
+            self.name,
+            1,
+            time.perf_counter() - self.wall,
+            time.process_time() - self.cpu,
+        )
+
+
+# What --profile measures, and how many entries its report lists by default
+PROFILE_KINDS = ("cpu", "mem")
+PROFILE_TOP = 20
+PROFILE_FILES = {"cpu": "invoice_profile.prof", "mem": "invoice_profile.snapshot"}
+
+
+@contextlib.contextmanager
+def profiling(kind, path=None, top=PROFILE_TOP, stream=None):
+    # Profile the code run in the block and report on it when the block
+    # exits, even by an exception. "cpu" runs it under cProfile, writes the
+    # stats to path for pstats or a viewer and prints the functions with the
+    # most time spent in them. "mem" traces allocations with tracemalloc,
+    # writes a snapshot of the memory still allocated at the end to path
+    # (loadable with tracemalloc.Snapshot.load) and prints the peak and the
+    # lines holding the most memory. Only this process is profiled.
+    if kind not in PROFILE_KINDS:
+        raise ValueError(f"Unknown profile {kind!r}, expected one of {PROFILE_KINDS}")
+    if path is None:
+        path = PROFILE_FILES[kind]
+    if stream is None:
+        stream = sys.stderr
+    if kind == "cpu":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            print(f"CPU profile written to {path}", file=stream)
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("tottime").print_stats(top)
+        return
+
+    import tracemalloc
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        # Only the allocating line is recorded; deeper tracebacks slow
+        # reportlab down many times over
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ]
+        )
+        snapshot.dump(path)
+        print(
+            f"Memory snapshot written to {path}: peak {peak / 2**20:.1f} MiB, "
+            f"{current / 2**20:.1f} MiB still allocated",
+            file=stream,
+        )
+        for stat in snapshot.statistics("lineno")[:top]:
+            print(stat, file=stream)
+
+
+# Collector for this process, or None while timing is disabled
+_timings = None
+_untimed = contextlib.nullcontext()
+
+
+def enable_timings():
+    # Start recording phase timings in this process and return the collector
+    global _timings
+    _timings = PhaseTimings()
+    return _timings
+
+
+def get_timings():
+    return _timings
+
+
+def phase(name):
+    # Context manager timing one phase; a shared no-op when timing is disabled
+    if _timings is None:
+        return _untimed
+    return _Phase(_timings, name)
+
+
+# Money is handled as integers so that totals are exact: amounts in minor
+# units (pence, cents), rates in 1/RATE_SCALE of a currency unit and
+# quantities in 1/UNIT_SCALE of a unit. Amounts round half away from zero.
+MINOR_UNITS = 100
+RATE_SCALE = 10000
+UNIT_SCALE = 1000000
+
+
+def to_fixed(value, scale):
+    # Convert a number (int, float, Decimal or numeric string) to an integer
+    # count of 1/scale, where scale is a power of ten. Floats are taken at
+    # their shortest repr, so 0.1 means one tenth. Values more precise than
+    # scale are rounded half away from zero. Raises ValueError if value is
+    # not a finite number.
+    if type(value) is int:
+        return value * scale
+    if type(value) is float:
+        # Exact when the nearest float to fixed / scale is value itself
+        fixed = round(value * scale) if math.isfinite(value) else None
+        if fixed is not None and abs(fixed) < 2 ** 53 and fixed / scale == value:
+            return fixed
+
+    try:
+        fixed = decimal.Decimal(str(value)) * scale
+    except decimal.InvalidOperation:
+        fixed = None
+    if fixed is None or not fixed.is_finite():
+        raise ValueError(f"Invalid number: {value!r}")
+    return int(fixed.to_integral_value(decimal.ROUND_HALF_UP))
+
+
+def _round_div(numerator, denominator):
+    # Integer division rounding half away from zero, for denominator > 0
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def line_amount(units, rate, vat):
+    # Return (amount excluding VAT, VAT) in minor units for fixed-point units
+    # and rate (to_fixed(units, UNIT_SCALE), to_fixed(rate, RATE_SCALE))
+    amount = _round_div(units * rate, UNIT_SCALE * RATE_SCALE // MINOR_UNITS)
+    vat_amount = _round_div(amount * VAT_PERCENT, 100) if vat else 0
+    return amount, vat_amount
+
+
+def batch_totals(units, rates, vat):
+    # line_amount for many line items at once, from equal-length sequences
+    # of fixed-point units and rates and of VAT flags. Returns (amounts,
+    # vat_amounts, (subtotal, vat_total, total)), the first two as arrays of
+    # minor units. Uses numpy when it is installed and the products fit in
+    # 64 bits, and the stdlib array module otherwise.
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None and len(units):
+        units = numpy.asarray(units, dtype=numpy.int64)
+        rates = numpy.asarray(rates, dtype=numpy.int64)
+        largest = int(numpy.abs(units).max()) * int(numpy.abs(rates).max())
+        if largest < 2 ** 62:
+            amounts = _round_div_array(
+                numpy, units * rates, UNIT_SCALE * RATE_SCALE // MINOR_UNITS
+            )
+            vat_amounts = _round_div_array(numpy, amounts * VAT_PERCENT, 100)
+            vat_amounts *= numpy.asarray(vat, dtype=bool)
+            subtotal = int(amounts.sum())
+            vat_total = int(vat_amounts.sum())
+            return amounts, vat_amounts, (subtotal, vat_total, subtotal + vat_total)
+
+    # _round_div inlined, which matters over millions of lines
+    divisor = UNIT_SCALE * RATE_SCALE // MINOR_UNITS
+    half = divisor // 2
+    amounts = array.array(
+        "q",
+        [
+            (product + half) // divisor
+            if product >= 0
+            else -((half - product) // divisor)
+            for product in map(operator.mul, units, rates)
+        ],
+    )
+    vat_amounts = array.array(
+        "q",
+        [
+            (
+                (amount * VAT_PERCENT + 50) // 100
+                if amount >= 0
+                else -((50 - amount * VAT_PERCENT) // 100)
+            )
+            if with_vat
+            else 0
+            for amount, with_vat in zip(amounts, vat)
+        ],
+    )
+    subtotal = sum(amounts)
+    vat_total = sum(vat_amounts)
+    return amounts, vat_amounts, (subtotal, vat_total, subtotal + vat_total)
+
+
+def _round_div_array(numpy, numerators, denominator):
+    # _round_div over a numpy integer array
+    quotients = (numpy.abs(numerators) + denominator // 2) // denominator
+    return numpy.where(numerators < 0, -quotients, quotients)
+
+
+def format_money(currency_symbol, minor):
+    # Format an amount in minor units, e.g. format_money("£", 123456) is
+    # "£1234.56"
+    sign = "-" if minor < 0 else ""
+    whole, fraction = divmod(abs(minor), MINOR_UNITS)
+    return f"{sign}{currency_symbol}{whole}.{fraction:02d}"
+
+
+def format_rate(currency_symbol, rate):
+    # Format a fixed-point rate with two decimals, or more when it has
+    # fractions of a minor unit
+    sign = "-" if rate < 0 else ""
+    whole, fraction = divmod(abs(rate), RATE_SCALE)
+    fraction = f"{fraction:0{len(str(RATE_SCALE)) - 1}d}".rstrip("0").ljust(2, "0")
+    return f"{sign}{currency_symbol}{whole}.{fraction}"
+
+
+def load_config(config_file):
     # Load company and client details from the specified config file
     with open(config_file, "r") as f:
-        config = json.load(f)
-
-    company_name = config["company_name"]
-    company_address = config["company_address"]
-    bank_details = config["bank_details"]
-    client_name = config["client_name"]
-    client_address = config["client_address"]
-    rate = float(config["rate"])
-
-    currency = config.get("currency", "USD")
-    currency_symbol = get_currency_symbol(currency)
-
-    unit_of_work = config.get("unit_of_work", "HOURLY")
-    if unit_of_work == "DAILY":
-        unit_header = "Number of Days"
-        rate_header = "Daily Rate"
-    elif unit_of_work == "WEEKLY":
-        unit_header = "Number of Weeks"
-        rate_header = "Weekly Rate"
-    elif unit_of_work == "MONTHLY":
-        unit_header = "Number of Months"
-        rate_header = "Monthly Rate"
+        return json.load(f)
+
+
+class ClientProfile:
+    # Everything derived from a config that does not change between invoices
+
+    def __init__(self, config):
+        missing = [field for field in REQUIRED_FIELDS if field not in config]
+        if missing:
+            raise ValueError(f"Config is missing {', '.join(missing)}")
+        # The invoice number and date sit beside the first two address lines
+        if len(config["company_address"]) < 2:
+            raise ValueError("company_address must have at least two lines")
+
+        self.company_name = config["company_name"]
+        self.company_address = config["company_address"]
+        self.bank_details = config["bank_details"]
+        self.client_name = config["client_name"]
+        self.client_address = config["client_address"]
+        self.rate = float(config["rate"])
+
+        self.currency = config.get("currency", "USD")
+        self.currency_symbol = get_currency_symbol(self.currency)
+
+        self.unit_of_work = config.get("unit_of_work", "HOURLY")
+        self.unit_header, self.rate_header = UNIT_HEADERS.get(
+            self.unit_of_work, UNIT_HEADERS["HOURLY"]
+        )
+
+        self.include_vat = config.get("include_vat", False)
+        self.accent_color = tuple(config.get("accent_color", DEFAULT_ACCENT_COLOR))
+
+        self.client_info = (
+            f"<b>Billed to:</b><br/>{self.client_name}"
+            f"<br/>{'<br/>'.join(self.client_address)}"
+        )
+        self.bank_details_text = "<br/>".join(self.bank_details)
+
+        # Static canvas layout, built by get_letterhead on first use
+        self.letterhead = None
+
+        # Identifies the config's content, whatever its key order or layout
+        self.fingerprint = hashlib.sha256(
+            json.dumps(config, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+
+
+_profile_cache = OrderedDict()
+# Guards _profile_cache, which the service's and async API's threads share
+_profile_lock = threading.Lock()
+
+
+def load_profile(config_file):
+    # Return the ClientProfile for config_file, re-reading the file only when
+    # its modification time or size has changed
+    with phase("config"):
+        stat = os.stat(config_file)
+        key = (os.path.abspath(config_file), stat.st_mtime_ns, stat.st_size)
+
+        with _profile_lock:
+            profile = _profile_cache.get(key)
+            if profile is not None:
+                _profile_cache.move_to_end(key)
+                return profile
+
+        profile = ClientProfile(load_config(config_file))
+        with _profile_lock:
+            _profile_cache[key] = profile
+            if len(_profile_cache) > PROFILE_CACHE_SIZE:
+                _profile_cache.popitem(last=False)
+        return profile
+
+
+class InvoiceTheme:
+    # Paragraph and table styles shared by every invoice using the same colours
+
+    def __init__(self, accent_color):
+        from reportlab.lib import colors
+        from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+        from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+        from reportlab.platypus import TableStyle
+
+        styles = getSampleStyleSheet()
+        accent = colors.Color(*accent_color)
+
+        self.accent = accent
+        self.normal_style = styles["Normal"]
+        self.title_style = ParagraphStyle(
+            "Title", parent=styles["Title"], textColor=accent, spaceAfter=6
+        )
+        self.right_style = ParagraphStyle(
+            "RightAlign", parent=styles["Normal"], alignment=TA_RIGHT
+        )
+        self.left_style = ParagraphStyle(
+            "LeftAlign", parent=styles["Normal"], alignment=TA_LEFT
+        )
+        self.description_style = ParagraphStyle(
+            "Description", parent=styles["Normal"], alignment=TA_CENTER
+        )
+        self.right_style_large = ParagraphStyle(
+            "RightAlignLarge",
+            parent=styles["Normal"],
+            alignment=TA_RIGHT,
+            fontSize=14,
+            fontName="Helvetica-Bold",
+            textColor=accent,
+        )
+
+        self.top_aligned = TableStyle([("VALIGN", (0, 0), (-1, -1), "TOP")])
+        self.details_table_style = TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+                ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+                ("BACKGROUND", (0, 1), (-1, -1), colors.white),
+                ("GRID", (0, 0), (-1, -1), 1, colors.black),
+            ]
+        )
+        # Added when some descriptions wrap onto more than one line
+        self.wrapped_rows_style = TableStyle([("VALIGN", (0, 1), (-1, -1), "MIDDLE")])
+
+
+_themes = {}
+
+
+def get_theme(accent_color=DEFAULT_ACCENT_COLOR):
+    # Themes are built on first use and reused for the life of the process
+    theme = _themes.get(accent_color)
+    if theme is None:
+        theme = _themes[accent_color] = InvoiceTheme(accent_color)
+    return theme
+
+
+def render_key(
+    profile, invoice_number, date, items, engine, reproducible=False, compress=False
+):
+    # A hash of everything that goes into an invoice's PDF. items are the
+    # invoice's LineItems, so equivalent ways of writing them (units as 40 or
+    # 40.0, untrimmed descriptions) share a key.
+    from reportlab import Version
+
+    return hashlib.sha256(
+        json.dumps(
+            [
+                RENDERER_VERSION,
+                Version,
+                engine,
+                reproducible,
+                compress,
+                profile.fingerprint,
+                str(invoice_number),
+                str(date),
+                [
+                    [description, float(units), float(rate), bool(vat)]
+                    for description, units, rate, vat in items
+                ],
+            ]
+        ).encode()
+    ).hexdigest()
+
+
+class RenderCache:
+    # Content-addressed store of rendered PDFs in a directory, keyed by
+    # render_key, so an invoice whose inputs have not changed is copied from
+    # the cache instead of rendered. Several processes can share the
+    # directory. Entries unused for max_age seconds, then the least recently
+    # used ones beyond max_bytes, are removed by evict().
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self.hits = self.misses = self.evictions = 0
+
+    def __getstate__(self):
+        # Copies sent to worker processes count only their own lookups, which
+        # are merged back with merge()
+        state = self.__dict__.copy()
+        state.update(hits=0, misses=0, evictions=0)
+        return state
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        # Return the cached PDF as bytes, or None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime > self.max_age:
+                    data = None
+                else:
+                    data = f.read()
+        except OSError:
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # The modification time records when an entry was last used
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return data
+
+    def put(self, key, data):
+        # Written under a temporary name and renamed into place, so readers
+        # never see a partial file
+        import tempfile
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+
+    def evict(self):
+        # Remove expired entries, then the least recently used until the
+        # cache fits in max_bytes. Returns the number of entries removed.
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pdf"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes and now - mtime <= self.max_age:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def merge(self, counts):
+        # Add (hits, misses) counted by a copy of this cache in another process
+        hits, misses = counts
+        self.hits += hits
+        self.misses += misses
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def format_summary(self):
+        summary = self.summary()
+        return (
+            f"Render cache: {summary['hits']} hits, {summary['misses']} misses "
+            f"({summary['hit_rate']:.0%} hit rate), {summary['evictions']} evicted"
+        )
+
+
+def _write_output(output, data):
+    # Write data to output, a path or a binary file-like object
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, "wb") as f:
+            f.write(data)
     else:
-        unit_header = "Number of Hours"
-        rate_header = "Hourly Rate"
+        output.write(data)
 
-    include_vat = config.get("include_vat", False)
 
-    total_amount = hours * rate
-    file_name = f"invoice_{invoice_number}.pdf"
+def generate_invoice(
+    config_file,
+    invoice_number,
+    date,
+    hours,
+    engine="platypus",
+    items=None,
+    ledger=None,
+    cache=None,
+    reproducible=False,
+    compress=False,
+):
+    # Write invoice_{invoice_number}.pdf, recording it in ledger (an
+    # InvoiceLedger) if one is given. Raises DuplicateInvoiceError, before
+    # writing anything, if the ledger already has the invoice number.
+    profile = load_profile(config_file)
+    if ledger is None:
+        file_name = build_invoice(
+            profile,
+            invoice_number,
+            date,
+            hours,
+            engine=engine,
+            items=items,
+            cache=cache,
+            reproducible=reproducible,
+            compress=compress,
+        )
+    else:
+        # The ledger stays locked while rendering so that no other process
+        # can take the number in between
+        with ledger.transaction():
+            if ledger.contains(invoice_number):
+                raise DuplicateInvoiceError(
+                    f"Invoice number {invoice_number} is already in the ledger"
+                )
+            file_name, totals = _build_invoice(
+                profile,
+                invoice_number,
+                date,
+                hours,
+                engine,
+                None,
+                items,
+                cache,
+                reproducible,
+                compress,
+            )
+            ledger.record(
+                _ledger_entry(
+                    profile, invoice_number, date, totals, os.path.abspath(file_name)
+                )
+            )
+    size = os.path.getsize(file_name)
+    print(f"Invoice {file_name} generated successfully ({size:,} bytes).")
+    return file_name
 
-    doc = SimpleDocTemplate(file_name, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = []
 
-    # Define color scheme
-    blue_color = colors.Color(0, 0.3, 0.5)  # Dark blue for title and amount due
+def render_invoice(
+    config_file,
+    invoice_number,
+    date,
+    hours,
+    output=None,
+    engine="platypus",
+    items=None,
+    cache=None,
+    reproducible=False,
+    compress=False,
+):
+    # Render an invoice without touching the working directory. Returns the
+    # PDF as bytes, or writes it to output (a binary file-like object or a
+    # path) when one is given.
+    profile = load_profile(config_file)
+    buffer = io.BytesIO() if output is None else output
+    build_invoice(
+        profile,
+        invoice_number,
+        date,
+        hours,
+        engine,
+        buffer,
+        items,
+        cache,
+        reproducible,
+        compress,
+    )
+    return buffer.getvalue() if output is None else None
 
-    # Add company name
-    title_style = ParagraphStyle(
-        "Title", parent=styles["Title"], textColor=blue_color, spaceAfter=6
+
+def build_invoice(
+    profile,
+    invoice_number,
+    date,
+    hours,
+    engine="platypus",
+    output=None,
+    items=None,
+    cache=None,
+    reproducible=False,
+    compress=False,
+):
+    # Render to output (a path or binary file-like object), defaulting to
+    # invoice_{invoice_number}.pdf in the working directory. Returns output.
+    # items, when given, replaces the single row billed for hours with one
+    # row per line item (see line_items). With a cache (a RenderCache), an
+    # invoice rendered before from the same inputs is copied from it. With
+    # reproducible set, the same inputs always give byte-identical PDFs.
+    # compress writes the smallest PDFs (see _render).
+    return _build_invoice(
+        profile,
+        invoice_number,
+        date,
+        hours,
+        engine,
+        output,
+        items,
+        cache,
+        reproducible,
+        compress,
+    )[0]
+
+
+def _build_invoice(
+    profile,
+    invoice_number,
+    date,
+    hours,
+    engine="platypus",
+    output=None,
+    items=None,
+    cache=None,
+    reproducible=False,
+    compress=False,
+):
+    # build_invoice, returning (output, (subtotal, vat, total))
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown rendering engine: {engine}")
+
+    with phase("totals"):
+        items = line_items(profile, hours, items)
+        headers, rows, totals = _details_rows(profile, items)
+        amount_due_text = _amount_due_text(profile, totals[2])
+    if output is None:
+        output = f"invoice_{invoice_number}.pdf"
+
+    key = None
+    if cache is not None or reproducible:
+        key = render_key(
+            profile, invoice_number, date, items, engine, reproducible, compress
+        )
+    seed = key if reproducible else None
+
+    if cache is not None:
+        data = cache.get(key)
+        if data is None:
+            buffer = io.BytesIO()
+            _render(
+                buffer,
+                profile,
+                engine,
+                invoice_number,
+                date,
+                headers,
+                rows,
+                amount_due_text,
+                seed,
+                compress,
+            )
+            data = buffer.getvalue()
+            cache.put(key, data)
+        _write_output(output, data)
+        return output, totals
+
+    _render(
+        output,
+        profile,
+        engine,
+        invoice_number,
+        date,
+        headers,
+        rows,
+        amount_due_text,
+        seed,
+        compress,
+    )
+    return output, totals
+
+
+def _render(
+    output,
+    profile,
+    engine,
+    invoice_number,
+    date,
+    headers,
+    rows,
+    amount_due_text,
+    seed=None,
+    compress=False,
+):
+    # Draw the laid-out invoice to output with the given engine, reproducibly
+    # (see _make_reproducible) when a seed is given. With compress, content
+    # streams are Flate compressed and written as binary, whatever reportlab's
+    # settings; by default reportlab also wraps compressed streams in ASCII85,
+    # which makes them a quarter larger.
+    with phase("styles"):
+        theme = get_theme(profile.accent_color)
+
+    # The canvas engines decline layouts they cannot draw exactly, in which
+    # case the invoice is rendered through platypus instead
+    if engine != "platypus" and _render_canvas(
+        output,
+        profile,
+        theme,
+        invoice_number,
+        date,
+        headers,
+        rows,
+        amount_due_text,
+        overlay=engine == "overlay",
+        seed=seed,
+        compress=compress,
+    ):
+        return
+
+    _render_platypus(
+        output,
+        profile,
+        theme,
+        invoice_number,
+        date,
+        headers,
+        rows,
+        amount_due_text,
+        seed,
+        compress,
+    )
+
+
+# One invoice of a pack, ready to render. items are its LineItems.
+PackInvoice = namedtuple(
+    "PackInvoice", "profile number date items headers rows amount_due_text"
+)
+
+
+def render_invoice_pack(
+    invoices, output=None, engine="platypus", reproducible=False, compress=False
+):
+    # Render several invoices into a single PDF in one pass, each starting on
+    # a new page with an outline entry (bookmark) of its own. invoices are
+    # dicts like the entries of a batch manifest: config, number, date and
+    # units or items. Returns the PDF as bytes, or writes it to output (a
+    # binary file-like object or a path) when one is given.
+    packed = []
+    for job in invoices:
+        hours, items = _job_work(job)
+        packed.append(
+            _pack_invoice(
+                load_profile(job["config"]), job["number"], job["date"], hours, items
+            )[0]
+        )
+    buffer = io.BytesIO() if output is None else output
+    _render_pack(buffer, packed, engine, reproducible, compress)
+    return buffer.getvalue() if output is None else None
+
+
+def _pack_invoice(profile, invoice_number, date, hours, items=None):
+    # Work out an invoice's table and totals for _render_pack. Returns
+    # (PackInvoice, (subtotal, vat, total)).
+    with phase("totals"):
+        items = line_items(profile, hours, items)
+        headers, rows, totals = _details_rows(profile, items)
+        amount_due_text = _amount_due_text(profile, totals[2])
+    invoice = PackInvoice(
+        profile, invoice_number, date, items, headers, rows, amount_due_text
     )
-    elements.append(Paragraph(company_name, title_style))
+    return invoice, totals
+
+
+def _render_pack(
+    output, invoices, engine="platypus", reproducible=False, compress=False
+):
+    # Render PackInvoices into one document. As for single invoices, the
+    # canvas engines are used only if every invoice fits on one page; the
+    # pack is rendered through platypus otherwise. Reproducible packs take
+    # their creation date from the latest invoice.
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown rendering engine: {engine}")
+    if not invoices:
+        raise ValueError("A pack needs at least one invoice")
+
+    seed = None
+    if reproducible:
+        seed = hashlib.sha256(
+            "".join(
+                render_key(
+                    invoice.profile,
+                    invoice.number,
+                    invoice.date,
+                    invoice.items,
+                    engine,
+                    reproducible,
+                    compress,
+                )
+                for invoice in invoices
+            ).encode()
+        ).hexdigest()
+    date = max(str(invoice.date) for invoice in invoices)
+    titles = [f"Invoice {invoice.number} ({invoice.date})" for invoice in invoices]
+
+    if engine != "platypus":
+        with phase("layout"):
+            pages = []
+            for invoice in invoices:
+                page = CanvasPage(
+                    invoice.profile,
+                    get_theme(invoice.profile.accent_color),
+                    invoice.number,
+                    invoice.date,
+                    invoice.headers,
+                    invoice.rows,
+                    invoice.amount_due_text,
+                )
+                if not page.fits:
+                    break
+                pages.append(page)
+        if len(pages) == len(invoices):
+            _draw_pages(
+                output, pages, engine == "overlay", seed, date, compress, titles
+            )
+            return
+
+    from reportlab.platypus import PageBreak
+    from reportlab.platypus.flowables import CallerMacro
+
+    with phase("flowables"):
+        elements = []
+        for index, (invoice, title) in enumerate(zip(invoices, titles)):
+            if index:
+                elements.append(PageBreak())
+            elements.append(
+                CallerMacro(
+                    lambda flowable, key=f"invoice{index}", title=title: (
+                        _add_bookmark(flowable.canv, key, title)
+                    )
+                )
+            )
+            elements.extend(
+                _platypus_story(
+                    invoice.profile,
+                    get_theme(invoice.profile.accent_color),
+                    invoice.number,
+                    invoice.date,
+                    invoice.headers,
+                    invoice.rows,
+                    invoice.amount_due_text,
+                )
+            )
+    _build_document(output, elements, seed, date, compress, outline=True)
+
+
+def _add_bookmark(canv, key, title):
+    # Bookmark the current page and list it in the document outline
+    canv.bookmarkPage(key)
+    canv.addOutlineEntry(title, key, level=0)
+
+
+# Held while any PDF is serialized, see _save_pdf
+_save_lock = threading.Lock()
+
+
+def _save_pdf(canv, output, compress=False):
+    # Write canv's PDF to output (a path or binary file-like object). Whether
+    # reportlab ASCII85-encodes compressed streams is a global setting, read
+    # as a PDF is serialized, so every PDF is serialized under one lock and
+    # the setting is only switched off, for compressed PDFs, while the lock is
+    # held. Writing the bytes out happens after the lock is released, so a
+    # slow file or pipe only holds up its own render.
+    from reportlab import rl_config
+
+    with _save_lock:
+        saved = rl_config.useA85
+        if compress:
+            rl_config.useA85 = 0
+        try:
+            data = canv.getpdfdata()
+        finally:
+            rl_config.useA85 = saved
+    _write_output(output, data)
+
+
+def _make_reproducible(canv, seed, date):
+    # Make everything reportlab writes to canv's PDF depend only on the
+    # invoice: the canvas must be created with invariant=True, which fixes
+    # the timestamps, and the document ID is derived from seed rather than
+    # the time. The creation date is the invoice date if it is an ISO date.
+    canv._doc.updateSignature(seed)
+    try:
+        stamp = datetime.date.fromisoformat(str(date)).strftime("D:%Y%m%d000000")
+    except ValueError:
+        return
+    canv.setDateFormatter(lambda *timestamp: f"{stamp}+00'00'")
+
+
+def check_invoice(config_file, invoice_number, date, hours, items=None):
+    # Validate the config and compute the totals without rendering anything
+    # (or importing reportlab). Returns the amount due text.
+    profile = load_profile(config_file)
+    _, _, totals = _details_rows(profile, line_items(profile, hours, items))
+    return _amount_due_text(profile, totals[2])
+
+
+def _amount_due_text(profile, total_amount):
+    return f"Amount Due: {format_money(profile.currency_symbol, total_amount)}"
+
+
+# One row of the line-item table. vat says whether VAT is charged on it.
+LineItem = namedtuple("LineItem", "description units rate vat")
+
+
+def line_items(profile, hours=None, items=None):
+    # Return the invoice's LineItems: one per entry of items (dicts with
+    # units and optionally description, rate and vat, which default to the
+    # profile's rate and include_vat), or a single row billing hours units
+    if items is None:
+        if hours is None:
+            raise ValueError("Either units or line items are required")
+        return [
+            LineItem(DEFAULT_DESCRIPTION, hours, profile.rate, profile.include_vat)
+        ]
+
+    if not isinstance(items, (list, tuple)):
+        raise ValueError("Line items must be a list")
+    result = []
+    for index, item in enumerate(items, 1):
+        if isinstance(item, LineItem):
+            result.append(item)
+            continue
+        if "units" not in item:
+            raise ValueError(f"Line item {index} has no units")
+        # Descriptions are one line, wrapped only if wider than the page
+        description = " ".join(str(item.get("description", "")).split())
+        result.append(
+            LineItem(
+                description or DEFAULT_DESCRIPTION,
+                float(item["units"]),
+                float(item.get("rate", profile.rate)),
+                bool(item.get("vat", profile.include_vat)),
+            )
+        )
+    if not result:
+        raise ValueError("An invoice needs at least one line item")
+    return result
+
+
+def _details_rows(profile, items):
+    # Return the line-item table's headers and rows and the invoice's
+    # (subtotal, vat, total) in minor units, totalling the items in the same
+    # pass that formats them. The VAT columns are shown when the profile or
+    # any item includes VAT.
+    currency_symbol = profile.currency_symbol
+    with_vat = profile.include_vat or any(item.vat for item in items)
+
+    headers = ["Description", profile.unit_header, profile.rate_header]
+    if with_vat:
+        headers.extend(["Amount", f"VAT ({VAT_PERCENT}%)", "Total Amount"])
+    else:
+        headers.append("Total Amount")
+
+    rows = []
+    subtotal = vat_total = 0
+    for description, units, rate, vat in items:
+        rate = to_fixed(rate, RATE_SCALE)
+        amount, vat_amount = line_amount(to_fixed(units, UNIT_SCALE), rate, vat)
+        row = [
+            description,
+            str(units),
+            format_rate(currency_symbol, rate),
+            format_money(currency_symbol, amount),
+        ]
+        if with_vat:
+            row.extend([
+                format_money(currency_symbol, vat_amount),
+                format_money(currency_symbol, amount + vat_amount)
+            ])
+        rows.append(row)
+        subtotal += amount
+        vat_total += vat_amount
+    return headers, rows, (subtotal, vat_total, subtotal + vat_total)
+
+
+# Glyph widths of the LAYOUT_FONTS in thousandths of an em, by character,
+# built by _width_table on first use
+_width_tables = {}
+
+
+def _width_table(font_name):
+    # Every character of the fonts' WinAnsi encoding, measured once. The
+    # table is only published when complete, so other threads never see it
+    # half built.
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    table = {}
+    for code in range(256):
+        try:
+            char = bytes([code]).decode("cp1252")
+        except UnicodeDecodeError:
+            continue
+        table[char] = round(stringWidth(char, font_name, 1000))
+    _width_tables[font_name] = table
+    return table
+
+
+def text_width(text, font_name, font_size):
+    # Same as reportlab's stringWidth, but looks the layout fonts' glyph
+    # widths up in a table instead of encoding the text first. Other fonts,
+    # and text with characters outside the table, are measured by reportlab.
+    if font_name in LAYOUT_FONTS:
+        table = _width_tables.get(font_name) or _width_table(font_name)
+        try:
+            # Summed and scaled in the same order as reportlab, so the result
+            # is identical to the last bit
+            return sum(map(table.__getitem__, text)) * 0.001 * font_size
+        except KeyError:
+            pass
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    return stringWidth(text, font_name, font_size)
+
+
+def _column_widths(headers, rows):
+    # Return the width of each header cell, of each row's cells and of each
+    # column, sized to its widest cell as Table does, in one pass over rows
+    header_widths = [
+        text_width(cell, TABLE_BOLD_FONT, TABLE_FONT_SIZE) for cell in headers
+    ]
+    col_widths = list(header_widths)
+    row_widths = []
+    for row in rows:
+        widths = [text_width(cell, TABLE_FONT, TABLE_FONT_SIZE) for cell in row]
+        row_widths.append(widths)
+        col_widths = [max(pair) for pair in zip(col_widths, widths)]
+    col_widths = [width + 2 * CELL_HPADDING for width in col_widths]
+    return header_widths, row_widths, col_widths
+
+
+# Line-item table layouts by header configuration and currency symbol, built
+# by _table_layout on first use
+_table_layouts = {}
+
+
+def _table_layout(headers, currency_symbol):
+    # Return the width of each header cell, and for each column the
+    # characters its cells are expected to be made of and the width of the
+    # widest of them. The headers only depend on the unit of work and whether
+    # the VAT columns are shown, so this is worked out once per configuration.
+    key = (tuple(headers), currency_symbol)
+    layout = _table_layouts.get(key)
+    if layout is None:
+        table = _width_tables.get(TABLE_FONT) or _width_table(TABLE_FONT)
+        header_widths = [
+            text_width(cell, TABLE_BOLD_FONT, TABLE_FONT_SIZE) for cell in headers
+        ]
+        # Descriptions are free text, the other columns formatted figures
+        text_chars = "".join(chr(code) for code in range(32, 127))
+        figure_chars = "0123456789.-" + "".join(
+            char for char in currency_symbol if char in table
+        )
+        charsets = [text_chars] + [figure_chars] * (len(headers) - 1)
+        glyph_widths = [
+            max(table[char] for char in chars) * 0.001 * TABLE_FONT_SIZE
+            for chars in charsets
+        ]
+        layout = _table_layouts[key] = (header_widths, charsets, glyph_widths)
+    return layout
+
+
+def _table_widths(headers, rows, currency_symbol):
+    # Return the width of each column of the line-item table, sized to its
+    # widest cell as Table does. Columns start at their header's width, and a
+    # cell is only measured when it could be wider than its column so far:
+    # when it has more characters than the column fits of its widest glyph,
+    # or characters outside the column's character set.
+    header_widths, charsets, glyph_widths = _table_layout(headers, currency_symbol)
+    col_widths = list(header_widths)
+    limits = [width // glyph for width, glyph in zip(col_widths, glyph_widths)]
+    for row in rows:
+        for index, cell in enumerate(row):
+            if len(cell) <= limits[index] and not cell.strip(charsets[index]):
+                continue
+            width = text_width(cell, TABLE_FONT, TABLE_FONT_SIZE)
+            if width > col_widths[index]:
+                col_widths[index] = width
+                limits[index] = width // glyph_widths[index]
+    return [width + 2 * CELL_HPADDING for width in col_widths]
+
+
+def _render_platypus(
+    output,
+    profile,
+    theme,
+    invoice_number,
+    date,
+    headers,
+    rows,
+    amount_due_text,
+    seed=None,
+    compress=False,
+):
+    with phase("flowables"):
+        elements = _platypus_story(
+            profile, theme, invoice_number, date, headers, rows, amount_due_text
+        )
+    _build_document(output, elements, seed, date, compress)
+
+
+def _build_document(
+    output, elements, seed=None, date=None, compress=False, outline=False
+):
+    # Platypus lays out, draws and serializes the document in one call. With
+    # outline, the PDF opens with its outline (bookmarks) shown.
+    from reportlab.platypus import SimpleDocTemplate
+
+    doc = SimpleDocTemplate(output, pagesize=PAGE_SIZE)
+
+    def first_page(canv, doc):
+        if seed is not None:
+            _make_reproducible(canv, seed, date)
+        if outline:
+            canv.showOutline()
+
+    if seed is not None:
+        doc.invariant = True
+    if compress:
+        doc.pageCompression = 1
+    # The document is written out by _save_pdf rather than by build
+    doc._doSave = 0
+    with phase("build"):
+        doc.build(elements, onFirstPage=first_page)
+        _save_pdf(doc.canv, output, compress)
+
+
+def _platypus_story(
+    profile, theme, invoice_number, date, headers, rows, amount_due_text
+):
+    # Return the flowables making up the invoice
+    from reportlab.lib import colors
+    from reportlab.platypus import LongTable, Paragraph, Spacer, Table
+    from reportlab.platypus.flowables import HRFlowable
+
+    elements = []
+
+    # Add company name
+    elements.append(Paragraph(profile.company_name, theme.title_style))
 
     # Add horizontal line under the title
     elements.append(
         HRFlowable(width="100%", thickness=1, color=colors.black, spaceAfter=6)
     )
 
-    # Create a right-aligned style for invoice details
-    right_style = ParagraphStyle(
-        "RightAlign", parent=styles["Normal"], alignment=TA_RIGHT
-    )
-
     # Create a table for company address and invoice details
     data = [
         [
-            Paragraph(company_address[0], styles["Normal"]),
-            Paragraph(f"Invoice Number: {invoice_number}", right_style),
+            Paragraph(profile.company_address[0], theme.normal_style),
+            Paragraph(f"Invoice Number: {invoice_number}", theme.right_style),
         ],
         [
-            Paragraph(company_address[1], styles["Normal"]),
-            Paragraph(f"Date: {date}", right_style),
+            Paragraph(profile.company_address[1], theme.normal_style),
+            Paragraph(f"Date: {date}", theme.right_style),
         ],
     ]
 
     # Add remaining address lines if any
-    for line in company_address[2:]:
-        data.append([Paragraph(line, styles["Normal"]), ""])
+    for line in profile.company_address[2:]:
+        data.append([Paragraph(line, theme.normal_style), ""])
 
-    address_table = Table(data, colWidths=[doc.width / 2] * 2)
-    address_table.setStyle(
-        TableStyle(
-            [
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ]
-        )
-    )
+    address_table = Table(data, colWidths=[DOC_WIDTH / 2] * 2)
+    address_table.setStyle(theme.top_aligned)
 
     # Add the address table to the elements list
     elements.append(address_table)
@@ -108,104 +1371,2132 @@ def generate_invoice(config_file, invoice_number, date, hours):
     )
 
     # Add client information
-    client_info = (
-        f"<b>Billed to:</b><br/>{client_name}<br/>{'<br/>'.join(client_address)}"
-    )
-    elements.append(Paragraph(client_info, styles["Normal"]))
+    elements.append(Paragraph(profile.client_info, theme.normal_style))
     elements.append(Spacer(1, 12))
 
-    # Add table with invoice details
-    headers = ["Description", unit_header, rate_header]
-    if include_vat:
-        headers.extend(["Amount", "VAT (20%)", "Total Amount"])
-    else:
-        headers.append("Total Amount")
+    # Add table with invoice details. Column widths and row heights are
+    # worked out up front, measuring only the cells that could widen their
+    # column, and LongTable only lays out the rows that fit on each page, so
+    # splitting thousands of rows across pages stays cheap. The header row is
+    # repeated on every page.
+    col_widths = _table_widths(headers, rows, profile.currency_symbol)
+    row_heights = [TABLE_LEADING + CELL_VPADDING + TABLE_HEADER_PADDING] + [
+        TABLE_LEADING + 2 * CELL_VPADDING
+    ] * len(rows)
+    overflow = sum(col_widths) - FRAME_WIDTH
+    if overflow > 0:
+        # The description column gets what the figures leave of the page, and
+        # descriptions wider than that wrap, so the totals are never clipped
+        col_widths[0] -= overflow
+        description_width = col_widths[0] - 2 * CELL_HPADDING
+        if description_width < text_width(headers[0], TABLE_BOLD_FONT, TABLE_FONT_SIZE):
+            raise ValueError("The line-item figures are too wide for the page")
+        from xml.sax.saxutils import escape
 
-    amount_excl_vat = hours * rate
-    row = [
-        "Consulting Services",
-        hours,
-        f"{currency_symbol}{rate:.2f}",
-        f"{currency_symbol}{amount_excl_vat:.2f}",
-    ]
-    if include_vat:
-        vat_amount = amount_excl_vat * 0.2
-        total_amount = amount_excl_vat + vat_amount
-        row.extend([
-            f"{currency_symbol}{vat_amount:.2f}",
-            f"{currency_symbol}{total_amount:.2f}"
-        ])
-
-    data = [headers, row]
-
-    table = Table(data)
-    table.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-                ("BACKGROUND", (0, 1), (-1, -1), colors.white),
-                ("GRID", (0, 0), (-1, -1), 1, colors.black),
-            ]
-        )
+        rows = list(rows)
+        for index, row in enumerate(rows):
+            if text_width(row[0], TABLE_FONT, TABLE_FONT_SIZE) > description_width:
+                description = Paragraph(escape(row[0]), theme.description_style)
+                rows[index] = [description] + row[1:]
+                # Measured by the table from the wrapped paragraph
+                row_heights[index + 1] = None
+    data = [headers] + rows
+    table = LongTable(
+        data,
+        colWidths=col_widths,
+        rowHeights=row_heights,
+        repeatRows=1,
     )
+    table.setStyle(theme.details_table_style)
+    if overflow > 0:
+        table.setStyle(theme.wrapped_rows_style)
     elements.append(table)
     elements.append(Spacer(1, 24))
 
-    # Create styles for bank details and amount due
-    left_style = ParagraphStyle("LeftAlign", parent=styles["Normal"], alignment=TA_LEFT)
-    right_style_large = ParagraphStyle(
-        "RightAlignLarge",
-        parent=styles["Normal"],
-        alignment=TA_RIGHT,
-        fontSize=14,
-        fontName="Helvetica-Bold",
-        textColor=blue_color,
-    )
-
     # Create a table for bank details and amount due
-    bank_details_text = "<br/>".join(bank_details)
-    amount_due_text = f"Amount Due: {currency_symbol}{total_amount:.2f}"
-
     bottom_table = Table(
         [
             [
-                Paragraph(bank_details_text, left_style),
-                Paragraph(amount_due_text, right_style_large),
+                Paragraph(profile.bank_details_text, theme.left_style),
+                Paragraph(amount_due_text, theme.right_style_large),
             ]
         ],
-        colWidths=[doc.width / 2] * 2,
+        colWidths=[DOC_WIDTH / 2] * 2,
     )
-    bottom_table.setStyle(TableStyle([("VALIGN", (0, 0), (-1, -1), "TOP")]))
+    bottom_table.setStyle(theme.top_aligned)
 
     elements.append(bottom_table)
+    return elements
 
-    doc.build(elements)
-    print(f"Invoice {file_name} generated successfully.")
 
+def _plain_text(text):
+    # Collapse whitespace the way Paragraph does. Returns None for empty text
+    # or text containing markup, which only platypus can lay out.
+    text = " ".join(str(text).split())
+    if not text or "<" in text or "&" in text:
+        return None
+    return text
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate an invoice.")
 
+def _register_fonts(canv):
+    # Give the layout fonts the same internal names (F1, F2) in every document
+    # so cached letterhead code can be replayed into any canvas
+    for font_name in LAYOUT_FONTS:
+        canv.setFont(font_name, 10)
+
+
+class Letterhead:
+    # Everything on the canvas engine's page that only depends on the profile:
+    # the title, rules, company address and billed-to block, and the bank
+    # details (drawn relative to the top of the bottom table). Positions match
+    # what platypus produces for the same content. fits is False when some of
+    # the text would need wrapping, in which case platypus has to be used.
+
+    def __init__(self, profile, theme):
+        from reportlab.lib import colors
+        from reportlab.pdfgen import canvas
+
+        normal = theme.normal_style
+        title = theme.title_style
+        self.body_font = body_font = normal.fontName
+        self.bold_font = bold_font = "Helvetica-Bold"
+        self.body_size = body_size = normal.fontSize
+        self.leading = leading = normal.leading
+        self.row_height = row_height = leading + 2 * CELL_VPADDING
+
+        # Both two-column tables span the full document width
+        self.cell_left = cell_left = DOC_LEFT + CELL_HPADDING
+        self.cell_right = DOC_LEFT + DOC_WIDTH - CELL_HPADDING
+        self.cell_width = cell_width = DOC_WIDTH / 2 - 2 * CELL_HPADDING
+
+        title_text = _plain_text(profile.company_name)
+        address = [_plain_text(line) for line in profile.company_address]
+        client = [_plain_text(profile.client_name)] + [
+            _plain_text(line) for line in profile.client_address
+        ]
+        bank = [_plain_text(line) for line in profile.bank_details]
+
+        self.fits = (
+            title_text is not None
+            and None not in address + client + bank
+            and len(address) >= 2
+            and text_width(title_text, title.fontName, title.fontSize) <= FRAME_WIDTH
+            and all(
+                text_width(line, body_font, body_size) <= cell_width
+                for line in address + bank
+            )
+            and all(
+                text_width(line, body_font, body_size) <= FRAME_WIDTH
+                for line in client
+            )
+        )
+        if not self.fits:
+            return
+
+        # Vertical positions, working down from the top of the frame
+        title_top = FRAME_TOP
+        rule_1 = title_top - title.leading - title.spaceAfter - 1
+        self.address_top = address_top = rule_1 - 6
+        rule_2 = address_top - len(address) * row_height - 12 - 2
+        client_top = rule_2 - 6
+        self.table_top = client_top - (len(client) + 1) * leading - 12
+        self.bottom_height = max(len(bank), 1) * leading + 2 * CELL_VPADDING
+        # Distinguishes this letterhead's forms from other configs' in a pack
+        self.form_suffix = "_" + profile.fingerprint[:16]
+
+        # Pre-render the static content as PDF operators, using a scratch
+        # canvas only for its font name mapping
+        scratch = canvas.Canvas(io.BytesIO())
+        _register_fonts(scratch)
+
+        rules = scratch.beginPath()
+        for y in (rule_1, rule_2):
+            rules.moveTo(FRAME_LEFT, y)
+            rules.lineTo(FRAME_LEFT + FRAME_WIDTH, y)
+
+        text = scratch.beginText()
+        text.setFillColor(theme.accent)
+        text.setFont(title.fontName, title.fontSize)
+        title_width = text_width(title_text, title.fontName, title.fontSize)
+        text.setTextOrigin(
+            FRAME_LEFT + (FRAME_WIDTH - title_width) / 2, title_top - title.fontSize
+        )
+        text.textOut(title_text)
+
+        text.setFillColor(colors.black)
+        text.setFont(body_font, body_size)
+        for index, line in enumerate(address):
+            text.setTextOrigin(cell_left, self.address_baseline(index))
+            text.textOut(line)
+
+        baseline = client_top - body_size
+        text.setFont(bold_font, body_size)
+        text.setTextOrigin(FRAME_LEFT, baseline)
+        text.textOut("Billed to:")
+        text.setFont(body_font, body_size)
+        for line in client:
+            baseline -= leading
+            text.setTextOrigin(FRAME_LEFT, baseline)
+            text.textOut(line)
+
+        self.header_code = (
+            f"q 1 w 1 J 0 0 0 RG {rules.getCode()} S Q\n{text.getCode()}"
+        )
+
+        # Bank details are drawn relative to the top of the bottom table
+        text = scratch.beginText()
+        text.setFillColor(colors.black)
+        text.setFont(body_font, body_size)
+        baseline = -CELL_VPADDING - body_size
+        for line in bank:
+            text.setTextOrigin(cell_left, baseline)
+            text.textOut(line)
+            baseline -= leading
+        self.bank_code = text.getCode()
+
+    def address_baseline(self, index):
+        top = self.address_top - index * self.row_height
+        return top - CELL_VPADDING - self.body_size
+
+
+def get_letterhead(profile):
+    # Built on first use and kept on the (cached) profile, so each config's
+    # static content is laid out once per process
+    if profile.letterhead is None:
+        profile.letterhead = Letterhead(profile, get_theme(profile.accent_color))
+    return profile.letterhead
+
+
+class CanvasPage:
+    # Per-invoice layout for the canvas engines: the invoice details, the
+    # line-item table and the amount due, positioned around the profile's
+    # Letterhead. fits is False when the page cannot be drawn exactly,
+    # including when the line items do not fit on a single page.
+
+    def __init__(
+        self, profile, theme, invoice_number, date, headers, rows, amount_due_text
+    ):
+        self.letterhead = letterhead = get_letterhead(profile)
+        self.fits = False
+        if not letterhead.fits:
+            return
+
+        self.large = large = theme.right_style_large
+        self.accent = theme.accent
+        body_font = letterhead.body_font
+        body_size = letterhead.body_size
+        cell_width = letterhead.cell_width
+        # Table cells sit their text this far above the bottom padding
+        self.text_offset = TABLE_LEADING - TABLE_FONT_SIZE
+
+        # Check the page has room for every row before measuring any of them
+        self.header_height = TABLE_LEADING + CELL_VPADDING + TABLE_HEADER_PADDING
+        self.header_bottom = letterhead.table_top - self.header_height
+        self.table_bottom = self.header_bottom - letterhead.row_height * len(rows)
+        self.bottom_top = self.table_bottom - 24
+        if self.bottom_top - letterhead.bottom_height < FRAME_BOTTOM:
+            return
+
+        details = [
+            _plain_text(f"Invoice Number: {invoice_number}"),
+            _plain_text(f"Date: {date}"),
+        ]
+        self.amount_due = amount_due = _plain_text(amount_due_text)
+        if None in details or amount_due is None:
+            return
+        self.details = [
+            (text, text_width(text, body_font, body_size)) for text in details
+        ]
+        self.amount_due_width = text_width(amount_due, large.fontName, large.fontSize)
+        if (
+            max(width for _, width in self.details) > cell_width
+            or self.amount_due_width > cell_width
+        ):
+            return
+
+        # Line-item table columns are sized to their widest cell, as Table does
+        self.headers = headers
+        self.rows = rows
+        self.header_widths, self.row_widths, self.col_widths = _column_widths(
+            headers, rows
+        )
+        self.table_width = table_width = sum(self.col_widths)
+        self.table_left = FRAME_LEFT + (FRAME_WIDTH - table_width) / 2
+        self.fits = table_width <= FRAME_WIDTH
+
+    def draw(self, canv, overlay=False, shared_forms=False):
+        # Draw the page onto canv, whose fonts must have been registered with
+        # _register_fonts. With overlay the letterhead is placed in form
+        # XObjects rather than the page stream; with shared_forms too, the
+        # forms are named after the letterhead and only added to canv once, so
+        # pages of the same document with the same letterhead share them.
+        from reportlab.lib import colors
+
+        letterhead = self.letterhead
+        body_font = letterhead.body_font
+        body_size = letterhead.body_size
+        cell_right = letterhead.cell_right
+        row_height = letterhead.row_height
+        table_top = letterhead.table_top
+        header_bottom = self.header_bottom
+        table_bottom = self.table_bottom
+        table_left = self.table_left
+        table_width = self.table_width
+
+        if overlay:
+            header_form = "letterhead"
+            bank_form = "bank_details"
+            if shared_forms:
+                header_form += letterhead.form_suffix
+                bank_form += letterhead.form_suffix
+            if not canv.hasForm(header_form):
+                canv.beginForm(header_form)
+                canv.addLiteral(letterhead.header_code)
+                canv.endForm()
+                # The bank details hang below the form's origin
+                canv.beginForm(bank_form, lowery=-PAGE_HEIGHT, uppery=0)
+                canv.addLiteral(letterhead.bank_code)
+                canv.endForm()
+            canv.doForm(header_form)
+        else:
+            canv.addLiteral(letterhead.header_code)
+
+        canv.saveState()
+        canv.translate(0, self.bottom_top)
+        if overlay:
+            canv.doForm(bank_form)
+        else:
+            canv.addLiteral(letterhead.bank_code)
+        canv.restoreState()
+
+        # Line-item table backgrounds and grid
+        canv.setLineWidth(1)
+        canv.setLineCap(1)
+        canv.setLineJoin(1)
+        canv.setStrokeColor(colors.black)
+        table_right = table_left + table_width
+        canv.setFillColor(colors.lightgrey)
+        canv.rect(
+            table_left, header_bottom, table_width, self.header_height, stroke=0, fill=1
+        )
+        canv.setFillColor(colors.white)
+        canv.rect(
+            table_left,
+            table_bottom,
+            table_width,
+            header_bottom - table_bottom,
+            stroke=0,
+            fill=1,
+        )
+        row_bottoms = [
+            header_bottom - row_height * index
+            for index in range(1, len(self.rows) + 1)
+        ]
+        for y in [table_top, header_bottom] + row_bottoms:
+            canv.line(table_left, y, table_right, y)
+        x = table_left
+        canv.line(x, table_bottom, x, table_top)
+        for width in self.col_widths:
+            x += width
+            canv.line(x, table_bottom, x, table_top)
+
+        # All per-invoice text goes into a single text object
+        text = canv.beginText()
+        text.setFillColor(colors.black)
+        text.setFont(body_font, body_size)
+        for index, (detail, width) in enumerate(self.details):
+            text.setTextOrigin(cell_right - width, letterhead.address_baseline(index))
+            text.textOut(detail)
+
+        text.setFont(TABLE_BOLD_FONT, TABLE_FONT_SIZE)
+        self._draw_cells(
+            text,
+            self.headers,
+            self.header_widths,
+            header_bottom + TABLE_HEADER_PADDING,
+        )
+        text.setFont(TABLE_FONT, TABLE_FONT_SIZE)
+        for row, widths, row_bottom in zip(self.rows, self.row_widths, row_bottoms):
+            self._draw_cells(text, row, widths, row_bottom + CELL_VPADDING)
+
+        large = self.large
+        text.setFillColor(self.accent)
+        text.setFont(large.fontName, large.fontSize)
+        text.setTextOrigin(
+            cell_right - self.amount_due_width,
+            self.bottom_top - CELL_VPADDING - large.fontSize,
+        )
+        text.textOut(self.amount_due)
+        canv.drawText(text)
+
+    def _draw_cells(self, text, cells, widths, baseline):
+        # Centre each cell of one table row in its column
+        x = self.table_left
+        baseline += self.text_offset
+        for cell, width, col_width in zip(cells, widths, self.col_widths):
+            text.setTextOrigin(x + (col_width - width) / 2, baseline)
+            text.textOut(cell)
+            x += col_width
+
+
+def _render_canvas(
+    output, profile, theme, invoice_number, date, headers, rows, amount_due_text,
+    overlay=False, seed=None, compress=False,
+):
+    # Draw the single-page layout straight onto a canvas, replaying the cached
+    # letterhead and drawing only the per-invoice content. Returns False,
+    # without writing anything, if some text would need wrapping or the page
+    # would overflow.
+    with phase("layout"):
+        page = CanvasPage(
+            profile, theme, invoice_number, date, headers, rows, amount_due_text
+        )
+    if not page.fits:
+        return False
+    _draw_pages(output, [page], overlay, seed, date, compress)
+    return True
+
+
+def _draw_pages(
+    output, pages, overlay=False, seed=None, date=None, compress=False, titles=None
+):
+    # Draw CanvasPages onto one canvas, one per PDF page. titles, when given,
+    # adds an outline entry per page, and makes pages with the same letterhead
+    # share its forms.
+    from reportlab.pdfgen import canvas
+
+    with phase("draw"):
+        canv = canvas.Canvas(
+            output,
+            pagesize=PAGE_SIZE,
+            invariant=None if seed is None else True,
+            pageCompression=1 if compress else None,
+        )
+        if seed is not None:
+            _make_reproducible(canv, seed, date)
+        _register_fonts(canv)
+        for index, page in enumerate(pages):
+            if titles is not None:
+                _add_bookmark(canv, f"invoice{index}", titles[index])
+            page.draw(canv, overlay, shared_forms=titles is not None)
+            canv.showPage()
+        if titles is not None:
+            canv.showOutline()
+    with phase("build"):
+        _save_pdf(canv, output, compress)
+
+
+def load_items(items_file):
+    # Load a JSON list of line items, as accepted by line_items
+    with open(items_file, "r") as f:
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError(f"{items_file} must contain a JSON list of line items")
+    return items
+
+
+def read_manifest(manifest_file):
+    # Yield (line_number, raw_line) for every non-blank line of a JSONL manifest
+    with open(manifest_file, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield line_number, line
+
+
+# Columns of a timesheet CSV read by read_csv_manifest. rate and description
+# are optional and override the client config's rate and the default
+# description when set.
+CSV_COLUMNS = ("client", "number", "date", "units")
+
+
+class ClientTable:
+    # Config file of every client id, from a JSON object mapping ids to config
+    # paths (relative to the table's own directory). Every config is loaded
+    # up front, so that a bad one is reported before a batch starts and
+    # forked workers inherit the parsed profiles.
+
+    def __init__(self, path):
+        with open(path, "r") as f:
+            table = json.load(f)
+        if not isinstance(table, dict):
+            raise ValueError(f"{path} must map client ids to config files")
+        base = os.path.dirname(os.path.abspath(path))
+        self.configs = {
+            str(client): os.path.join(base, config) for client, config in table.items()
+        }
+        for client, config in self.configs.items():
+            try:
+                load_profile(config)
+            except Exception as e:
+                raise ValueError(f"Config of client {client}: {e}") from e
+
+    def config(self, client):
+        try:
+            return self.configs[client]
+        except KeyError:
+            raise ValueError(f"Unknown client {client!r}") from None
+
+
+def read_csv_manifest(csv_file, clients, rejected):
+    # Yield (line_number, manifest_line) for every row of a timesheet CSV,
+    # joining its client id against clients (a ClientTable), so CSV exports
+    # can go wherever a JSONL manifest can. The file is streamed a row at a
+    # time. Rows that cannot be converted are appended to rejected as failed
+    # JobResults instead. A row without a number gets one from --auto-number.
+    # Raises ValueError straight away if a column is missing.
+    import csv
+
+    f = open(csv_file, "r", encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(f)
+    try:
+        check_csv_columns(csv_file, reader.fieldnames)
+    except ValueError:
+        f.close()
+        raise
+    return _csv_entries(f, reader, clients, rejected)
+
+
+def check_csv_columns(csv_file, fieldnames=None):
+    # Raise ValueError if the CSV lacks any of CSV_COLUMNS, reading its header
+    # unless fieldnames are given
+    import csv
+
+    if fieldnames is None:
+        with open(csv_file, "r", encoding="utf-8-sig", newline="") as f:
+            fieldnames = csv.DictReader(f).fieldnames
+    missing = [column for column in CSV_COLUMNS if column not in (fieldnames or ())]
+    if missing:
+        raise ValueError(f"{csv_file} has no {', '.join(missing)} column")
+
+
+def _csv_entries(f, reader, clients, rejected):
+    with f:
+        for row in reader:
+            line_number = reader.line_num
+            # Short rows have None for their missing fields, and the extra
+            # fields of long rows are listed under None, which is ignored
+            row = {
+                column: (value or "").strip()
+                for column, value in row.items()
+                if column is not None
+            }
+            try:
+                job = {"config": clients.config(row["client"])}
+                if row["number"]:
+                    job["number"] = row["number"]
+                job["date"] = row["date"]
+                units = float(row["units"])
+                rate = row.get("rate")
+                description = row.get("description")
+                if rate or description:
+                    item = {"units": units, "description": description}
+                    if rate:
+                        item["rate"] = float(rate)
+                    job["items"] = [item]
+                else:
+                    job["units"] = units
+            except Exception as e:
+                rejected.append(
+                    JobResult(line_number, None, f"{type(e).__name__}: {e}", None)
+                )
+                continue
+            yield line_number, json.dumps(job)
+
+
+def _manifest_entries(manifest_file, clients, rejected):
+    # The entries of a JSONL manifest, or of a timesheet CSV when clients is
+    # given
+    if clients is None:
+        return read_manifest(manifest_file)
+    return read_csv_manifest(manifest_file, clients, rejected)
+
+
+# Outcome of one manifest entry. name is the invoice's file name, error the
+# reason it failed, data the rendered PDF for in-memory batches, entry its
+# LedgerEntry and staged the temporary file it was written to for staged
+# batches.
+JobResult = namedtuple(
+    "JobResult", "line_number name error data entry staged", defaults=(None, None)
+)
+
+
+def _job_work(job):
+    # Manifest entries and service requests bill either a number of units or
+    # a list of line items. Returns (hours, items).
+    if "items" in job:
+        return None, job["items"]
+    return float(job["units"]), None
+
+
+def run_job(line_number, line, options, in_memory=False, staged=False):
+    # Render one manifest entry with the given build_invoice keyword options,
+    # keeping the PDF in memory instead of writing a file when in_memory is set.
+    # When staged is set the file is written under a temporary name, which
+    # the caller renames to the invoice's own once it is recorded.
+    staged_path = None
+    try:
+        job = json.loads(line)
+        profile = load_profile(job["config"])
+        name = f"invoice_{job['number']}.pdf"
+        if in_memory:
+            output = io.BytesIO()
+        elif staged:
+            import tempfile
+
+            fd, staged_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(name)),
+                prefix=f".{os.path.basename(name)}.",
+                suffix=".tmp",
+            )
+            os.close(fd)
+            output = staged_path
+        else:
+            output = name
+        hours, items = _job_work(job)
+        _, totals = _build_invoice(
+            profile,
+            job["number"],
+            job["date"],
+            hours,
+            output=output,
+            items=items,
+            **options,
+        )
+    except Exception as e:
+        if staged_path is not None:
+            os.remove(staged_path)
+        return JobResult(line_number, None, f"{type(e).__name__}: {e}", None)
+    if in_memory:
+        data = output.getvalue()
+        path = name
+    else:
+        data = None
+        path = os.path.abspath(name)
+    entry = _ledger_entry(profile, job["number"], job["date"], totals, path)
+    return JobResult(line_number, name, None, data, entry, staged_path)
+
+
+def _run_chunk(chunk, options, in_memory, timed=False, staged=False):
+    # Returns (results, phases, cache_counts); phases holds the chunk's
+    # timings when timed, and cache_counts the (hits, misses) of the render
+    # cache in options, if there is one
+    timings = enable_timings() if timed else None
+    results = [
+        run_job(line_number, line, options, in_memory, staged)
+        for line_number, line in chunk
+    ]
+    cache = options.get("cache")
+    return (
+        results,
+        timings.phases if timings is not None else None,
+        (cache.hits, cache.misses) if cache is not None else None,
+    )
+
+
+def _chunk_results(future, cache=None):
+    # Unpack a finished _run_chunk, merging its timings and render cache
+    # counts into this process's
+    results, phases, cache_counts = future.result()
+    if phases is not None and _timings is not None:
+        _timings.merge(phases)
+    if cache_counts is not None and cache is not None:
+        cache.merge(cache_counts)
+    return results
+
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _mp_context():
+    # Forked workers inherit the reportlab modules imported here, rather than
+    # each importing them on its first invoice
+    import multiprocessing
+
+    import reportlab.pdfgen.canvas  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def iter_batch_results(
+    entries,
+    options,
+    workers=1,
+    chunk_size=16,
+    ordered=True,
+    in_memory=False,
+    staged=False,
+):
+    # Render (line_number, line) entries, yielding one JobResult per entry
+    # (see run_job for in_memory and staged)
+    from concurrent.futures import (
+        FIRST_COMPLETED,
+        ProcessPoolExecutor,
+        as_completed,
+        wait,
+    )
+
+    if workers <= 1:
+        for line_number, line in entries:
+            yield run_job(line_number, line, options, in_memory, staged)
+        return
+
+    # Keep a bounded window of chunks in flight so neither the manifest nor
+    # the rendered PDFs of a huge batch are ever held in memory all at once
+    max_pending = workers * 2
+    chunks = _chunked(entries, chunk_size)
+    # Workers time their own chunks when timing is enabled here
+    timed = _timings is not None
+    chunk_args = (options, in_memory, timed, staged)
+    cache = options.get("cache")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context()) as executor:
+        if ordered:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_run_chunk, chunk, *chunk_args))
+                if len(pending) >= max_pending:
+                    yield from _chunk_results(pending.popleft(), cache)
+            while pending:
+                yield from _chunk_results(pending.popleft(), cache)
+        else:
+            pending = set()
+            for chunk in chunks:
+                pending.add(executor.submit(_run_chunk, chunk, *chunk_args))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from _chunk_results(future, cache)
+            for future in as_completed(pending):
+                yield from _chunk_results(future, cache)
+
+
+class InvoiceArchive:
+    # Writes rendered invoices straight into a .zip, .tar, .tar.gz or .tgz
+    # archive, one member per invoice
+
+    def __init__(self, path):
+        import tarfile
+        import zipfile
+
+        self.path = path
+        if path.endswith(".zip"):
+            self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+            self._tar = None
+        elif path.endswith((".tar.gz", ".tgz")):
+            self._zip = None
+            self._tar = tarfile.open(path, "w:gz")
+        elif path.endswith(".tar"):
+            self._zip = None
+            self._tar = tarfile.open(path, "w")
+        else:
+            raise ValueError(f"Unsupported archive type: {path}")
+
+    def add(self, name, data):
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        else:
+            import tarfile
+
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_batch(manifest_file, clients=None):
+    # Validate every manifest entry and its config, reporting each invoice's
+    # amount due without rendering anything
+    valid = 0
+    invalid = 0
+
+    def report_failure(result):
+        nonlocal invalid
+        invalid += 1
+        print(f"[FAIL] line {result.line_number}: {result.error}", file=sys.stderr)
+
+    rejected = deque()
+    for line_number, line in _manifest_entries(manifest_file, clients, rejected):
+        while rejected:
+            report_failure(rejected.popleft())
+        try:
+            job = json.loads(line)
+            hours, items = _job_work(job)
+            amount_due_text = check_invoice(
+                job["config"], job["number"], job["date"], hours, items
+            )
+        except Exception as e:
+            invalid += 1
+            print(
+                f"[FAIL] line {line_number}: {type(e).__name__}: {e}", file=sys.stderr
+            )
+        else:
+            valid += 1
+            print(f"[OK] invoice_{job['number']}.pdf: {amount_due_text}")
+    while rejected:
+        report_failure(rejected.popleft())
+    print(
+        f"Dry run complete: {valid} valid, {invalid} invalid, "
+        f"{valid + invalid} total"
+    )
+    return invalid == 0
+
+
+@contextlib.contextmanager
+def _write_transaction(db):
+    # Hold the database's write lock for the duration, committing on success.
+    # db must be in autocommit mode (isolation_level=None).
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+# One invoice in the ledger. Amounts are in minor units. output is the path
+# of the PDF, or the archive's path joined with the member name.
+LedgerEntry = namedtuple(
+    "LedgerEntry",
+    "number client date currency subtotal vat total output created_at",
+    defaults=(None,),
+)
+
+
+class DuplicateInvoiceError(ValueError):
+    pass
+
+
+class InvoiceLedger:
+    # SQLite record of generated invoices. Invoice numbers are unique, and
+    # lookups by number, client (and date), date range and currency are
+    # indexed. Dates are stored as given, so date ranges assume ISO dates.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS invoices (
+            number TEXT NOT NULL,
+            client TEXT NOT NULL,
+            date TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            subtotal INTEGER NOT NULL,
+            vat INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            output TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS invoices_number ON invoices (number);
+        CREATE INDEX IF NOT EXISTS invoices_client_date ON invoices (client, date);
+        CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date);
+        CREATE INDEX IF NOT EXISTS invoices_currency ON invoices (currency);
+    """
+
+    INSERT = """
+        INSERT INTO invoices
+            (number, client, date, currency, subtotal, vat, total, output)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        # Transactions are managed explicitly; WAL lets readers carry on
+        # while a batch is being recorded
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+
+    def transaction(self):
+        return _write_transaction(self._db)
+
+    def contains(self, number):
+        row = self._db.execute(
+            "SELECT 1 FROM invoices WHERE number = ?", (str(number),)
+        ).fetchone()
+        return row is not None
+
+    def record(self, entry):
+        # Add one entry, raising DuplicateInvoiceError if its number is taken
+        import sqlite3
+
+        try:
+            self._db.execute(self.INSERT, self._values(entry))
+        except sqlite3.IntegrityError:
+            raise DuplicateInvoiceError(
+                f"Invoice number {entry.number} is already in the ledger"
+            ) from None
+
+    def record_many(self, entries):
+        # Add entries in a single transaction, returning those whose number
+        # was already taken
+        import sqlite3
+
+        duplicates = []
+        with self.transaction():
+            for entry in entries:
+                try:
+                    self._db.execute(self.INSERT, self._values(entry))
+                except sqlite3.IntegrityError:
+                    duplicates.append(entry)
+        return duplicates
+
+    def find(self, number=None, client=None, start=None, end=None, currency=None):
+        # Return the LedgerEntries matching every given criterion, by date.
+        # start and end are inclusive dates.
+        clauses = []
+        params = []
+        for clause, value in (
+            ("number = ?", number),
+            ("client = ?", client),
+            ("date >= ?", start),
+            ("date <= ?", end),
+            ("currency = ?", currency),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(str(value))
+        query = f"SELECT {', '.join(LedgerEntry._fields)} FROM invoices"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY date, number"
+        return [LedgerEntry(*row) for row in self._db.execute(query, params)]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _values(entry):
+        return (str(entry.number),) + tuple(entry[1:8])
+
+
+def _ledger_entry(profile, invoice_number, date, totals, output):
+    return LedgerEntry(
+        str(invoice_number),
+        profile.client_name,
+        str(date),
+        profile.currency,
+        *totals,
+        output,
+    )
+
+
+class InvoiceNumberSequence:
+    # Invoice numbers from a SQLite sequence that any number of processes can
+    # share. Each process reserves block_size numbers at a time, so they
+    # rarely wait on each other, and returns the ones it did not use on
+    # close(), to be handed out again. A process that dies without closing
+    # the sequence leaves a gap of at most block_size numbers.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            next INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS free_numbers (
+            name TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            PRIMARY KEY (name, number)
+        );
+    """
+
+    def __init__(self, path, block_size=NUMBER_BLOCK_SIZE, name="invoices", start=1):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        import sqlite3
+
+        self.path = path
+        self.block_size = block_size
+        self.name = name
+        self._block = deque()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.execute(
+            "INSERT OR IGNORE INTO sequences (name, next) VALUES (?, ?)", (name, start)
+        )
+
+    def allocate(self):
+        # Return the next number, reserving a new block when this one is used up
+        if not self._block:
+            self._block.extend(self._reserve(self.block_size))
+        return self._block.popleft()
+
+    def release(self, numbers):
+        # Give back numbers that were allocated but not used, e.g. because
+        # rendering the invoice failed
+        with _write_transaction(self._db):
+            self._db.executemany(
+                "INSERT OR IGNORE INTO free_numbers (name, number) VALUES (?, ?)",
+                [(self.name, number) for number in numbers],
+            )
+
+    def close(self):
+        if self._block:
+            self.release(self._block)
+            self._block.clear()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _reserve(self, count):
+        # Take up to count returned numbers, lowest first, and the rest from
+        # the sequence, in one transaction
+        db = self._db
+        with _write_transaction(db):
+            numbers = [
+                number
+                for (number,) in db.execute(
+                    "SELECT number FROM free_numbers WHERE name = ? "
+                    "ORDER BY number LIMIT ?",
+                    (self.name, count),
+                )
+            ]
+            if numbers:
+                db.execute(
+                    "DELETE FROM free_numbers WHERE name = ? AND number <= ?",
+                    (self.name, numbers[-1]),
+                )
+            if len(numbers) < count:
+                (next_number,) = db.execute(
+                    "SELECT next FROM sequences WHERE name = ?", (self.name,)
+                ).fetchone()
+                end = next_number + count - len(numbers)
+                db.execute(
+                    "UPDATE sequences SET next = ? WHERE name = ?", (end, self.name)
+                )
+                numbers.extend(range(next_number, end))
+        return numbers
+
+
+def _allocate_unrecorded(sequence, number_format, ledger=None):
+    # Allocate the next number from sequence that the ledger does not already
+    # hold. Numbers it holds, e.g. given by hand with -n, are used up rather
+    # than released, since released numbers are the first handed out again.
+    while True:
+        number = sequence.allocate()
+        if ledger is None or not ledger.contains(number_format.format(number)):
+            return number
+
+
+def _numbered(entries, sequence, number_format, assigned, ledger=None):
+    # Give manifest entries without a number the next one from sequence that
+    # is not in the ledger, noting it in assigned (line number -> allocated
+    # number) so it can be released if the invoice fails
+    for line_number, line in entries:
+        try:
+            job = json.loads(line)
+        except ValueError:
+            yield line_number, line
+            continue
+        if isinstance(job, dict) and "number" not in job:
+            number = _allocate_unrecorded(sequence, number_format, ledger)
+            assigned[line_number] = number
+            job["number"] = number_format.format(number)
+            line = json.dumps(job)
+        yield line_number, line
+
+
+def _unrecorded(entries, ledger, rejected):
+    # Pass on manifest entries whose invoice number is neither in the ledger
+    # nor earlier in the batch, appending a failed JobResult to rejected for
+    # the others. Entries that cannot be parsed are left for run_job to report.
+    seen = set()
+    for line_number, line in entries:
+        try:
+            number = str(json.loads(line)["number"])
+        except Exception:
+            yield line_number, line
+            continue
+        if number in seen or ledger.contains(number):
+            error = (
+                f"DuplicateInvoiceError: Invoice number {number} is already "
+                f"{'in the batch' if number in seen else 'in the ledger'}"
+            )
+            rejected.append(JobResult(line_number, None, error, None))
+            continue
+        seen.add(number)
+        yield line_number, line
+
+
+def run_batch(
+    manifest_file,
+    workers=1,
+    chunk_size=16,
+    ordered=True,
+    archive=None,
+    ledger=None,
+    sequence=None,
+    number_format=NUMBER_FORMAT,
+    clients=None,
+    **options,
+):
+    # Render every invoice in the manifest, writing invoice_<number>.pdf files
+    # or, when archive is given, members of that archive. With a ledger,
+    # numbers it already has are skipped and the new invoices are recorded in
+    # one transaction at the end. Until then their files are written under
+    # temporary names, so a concurrent batch given the same numbers cannot
+    # overwrite invoices it did not record. With a sequence (an
+    # InvoiceNumberSequence), entries without a number are numbered from it.
+    # With clients (a ClientTable), the manifest is a timesheet CSV (see
+    # read_csv_manifest).
+    succeeded = 0
+    failed = 0
+    written = 0
+    start = time.perf_counter()
+    assigned = {}
+
+    def report_failure(result):
+        nonlocal failed
+        failed += 1
+        print(f"[FAIL] line {result.line_number}: {result.error}", file=sys.stderr)
+        number = assigned.pop(result.line_number, None)
+        # A number that turned out to be taken is used up, not released
+        if number is not None and not result.error.startswith(
+            "DuplicateInvoiceError"
+        ):
+            sequence.release([number])
+
+    rejected = deque()
+    entries = _manifest_entries(manifest_file, clients, rejected)
+    recorded = []
+    # Invoice number -> temporary file of the invoices waiting to be recorded
+    staged = {}
+    if sequence is not None:
+        entries = _numbered(entries, sequence, number_format, assigned, ledger)
+    if ledger is not None:
+        entries = _unrecorded(entries, ledger, rejected)
+
+    archive_path = archive and os.path.abspath(archive)
+    archive = InvoiceArchive(archive) if archive else None
+    try:
+        results = iter_batch_results(
+            entries,
+            options,
+            workers,
+            chunk_size,
+            ordered,
+            in_memory=archive is not None,
+            staged=ledger is not None and archive is None,
+        )
+        for result in results:
+            while rejected:
+                report_failure(rejected.popleft())
+            if result.error is None:
+                assigned.pop(result.line_number, None)
+                entry = result.entry
+                if archive is not None:
+                    written += len(result.data)
+                    archive.add(result.name, result.data)
+                    entry = entry._replace(
+                        output=os.path.join(archive_path, result.name)
+                    )
+                elif result.staged is not None:
+                    written += os.path.getsize(result.staged)
+                    staged[entry.number] = result.staged
+                else:
+                    written += os.path.getsize(entry.output)
+                if ledger is not None:
+                    recorded.append(entry)
+                succeeded += 1
+                print(f"[OK] {result.name}")
+            else:
+                report_failure(result)
+        while rejected:
+            report_failure(rejected.popleft())
+    finally:
+        if archive is not None:
+            archive.close()
+        # Whatever was written is recorded, even if the batch was interrupted
+        if recorded:
+            for entry in ledger.record_many(recorded):
+                # Taken by another process while the batch was running, so
+                # the file of that process's invoice is left alone
+                succeeded -= 1
+                failed += 1
+                path = staged.pop(entry.number, None)
+                if path is not None:
+                    written -= os.path.getsize(path)
+                    os.remove(path)
+                print(
+                    f"[FAIL] invoice {entry.number}: DuplicateInvoiceError: "
+                    "Invoice number was recorded by another process; "
+                    f"{entry.output} was not "
+                    f"{'written' if path is not None else 'recorded'}",
+                    file=sys.stderr,
+                )
+            for entry in recorded:
+                path = staged.pop(entry.number, None)
+                if path is not None:
+                    os.replace(path, entry.output)
+
+    elapsed = time.perf_counter() - start
+    total = succeeded + failed
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Batch complete: {succeeded} succeeded, {failed} failed, "
+        f"{total} total in {elapsed:.2f}s ({throughput:.1f} invoices/sec, "
+        f"{workers} worker{'s' if workers != 1 else ''}), {written:,} bytes of PDF"
+    )
+    return failed == 0
+
+
+def run_pack(manifest_file, pack, ledger=None, clients=None, **options):
+    # Render every invoice in the manifest (a timesheet CSV with clients, as
+    # for run_batch) into the single PDF pack, with render_invoice_pack's
+    # options. Entries that cannot be read, or whose
+    # number the ledger already has, are reported and left out; the others
+    # are recorded in the ledger once the pack is written.
+    failed = 0
+    start = time.perf_counter()
+
+    def report_failure(result):
+        nonlocal failed
+        failed += 1
+        print(f"[FAIL] line {result.line_number}: {result.error}", file=sys.stderr)
+
+    rejected = deque()
+    entries = _manifest_entries(manifest_file, clients, rejected)
+    if ledger is not None:
+        entries = _unrecorded(entries, ledger, rejected)
+
+    invoices = []
+    recorded = []
+    path = os.path.abspath(pack)
+    for line_number, line in entries:
+        while rejected:
+            report_failure(rejected.popleft())
+        try:
+            job = json.loads(line)
+            profile = load_profile(job["config"])
+            hours, items = _job_work(job)
+            invoice, totals = _pack_invoice(
+                profile, job["number"], job["date"], hours, items
+            )
+        except Exception as e:
+            report_failure(
+                JobResult(line_number, None, f"{type(e).__name__}: {e}", None)
+            )
+            continue
+        invoices.append(invoice)
+        recorded.append(
+            _ledger_entry(profile, job["number"], job["date"], totals, path)
+        )
+    while rejected:
+        report_failure(rejected.popleft())
+
+    if invoices:
+        try:
+            _render_pack(pack, invoices, **options)
+        except Exception as e:
+            failed += len(invoices)
+            invoices = recorded = []
+            print(f"[FAIL] {pack}: {type(e).__name__}: {e}", file=sys.stderr)
+        else:
+            print(f"[OK] {pack}: {len(invoices)} invoices")
+    if ledger is not None and recorded:
+        for entry in ledger.record_many(recorded):
+            failed += 1
+            print(
+                f"[FAIL] invoice {entry.number}: DuplicateInvoiceError: "
+                "Invoice number was recorded by another process; "
+                f"it is in {pack} but was not recorded",
+                file=sys.stderr,
+            )
+
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(pack) if invoices else 0
+    print(
+        f"Pack complete: {len(invoices)} invoices in {pack}, {failed} failed, "
+        f"in {elapsed:.2f}s, {size:,} bytes of PDF"
+    )
+    return failed == 0
+
+
+class LatencyStats:
+    # Thread-safe record of recent request latencies
+
+    def __init__(self, max_samples=10000):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=max_samples)
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self._samples.append(seconds)
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            summary = {"requests": self.requests, "errors": self.errors}
+        summary["latency_ms"] = {
+            name: round(percentile(samples, pct) * 1000, 3)
+            for name, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        }
+        return summary
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted sequence
+    if not sorted_values:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class AsyncInvoiceRenderer:
+    # Renders invoices for asyncio code without blocking the event loop. The
+    # rendering runs on executor (by default a pool of warm processes, one per
+    # CPU, shut down by aclose()), at most max_in_flight (by default one per
+    # CPU) invoices at a time; further calls wait their turn. queued is the
+    # number waiting, which callers can watch to shed load, and with
+    # max_queued set, calls that would wait behind that many others raise
+    # QueueFullError instead of queueing.
+
+    def __init__(self, executor=None, max_in_flight=None, max_queued=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = os.cpu_count() or 1
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=_mp_context(), initializer=_warm_worker
+            )
+            _start_workers(executor, workers)
+        self.executor = executor
+        self.max_in_flight = max_in_flight or workers
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.stats = LatencyStats()
+        # Semaphores belong to an event loop, so one is made per loop used
+        self._semaphore = None
+        self._loop = None
+
+    async def render(
+        self,
+        config_file,
+        invoice_number,
+        date,
+        hours,
+        engine="platypus",
+        items=None,
+        reproducible=False,
+        compress=False,
+    ):
+        # render_invoice, returning the PDF as bytes
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        # Only calls that would have to wait count against max_queued
+        if (
+            self.max_queued is not None
+            and self._semaphore.locked()
+            and self.queued >= self.max_queued
+        ):
+            self.rejected += 1
+            raise QueueFullError(f"{self.queued} invoices are already waiting")
+
+        start = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        ok = False
+        try:
+            data = await loop.run_in_executor(
+                self.executor,
+                functools.partial(
+                    render_invoice,
+                    config_file,
+                    invoice_number,
+                    date,
+                    hours,
+                    engine=engine,
+                    items=items,
+                    reproducible=reproducible,
+                    compress=compress,
+                ),
+            )
+            ok = True
+            return data
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self.stats.record(time.perf_counter() - start, ok)
+
+    def summary(self):
+        # Latency percentiles (including time spent queued) and load
+        summary = self.stats.summary()
+        summary["in_flight"] = self.in_flight
+        summary["queued"] = self.queued
+        summary["rejected"] = self.rejected
+        return summary
+
+    async def aclose(self):
+        import asyncio
+
+        if self._owns_executor:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.executor.shutdown
+            )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+# Used by render_invoice_async when no renderer is given
+_async_renderer = None
+
+
+async def render_invoice_async(
+    config_file,
+    invoice_number,
+    date,
+    hours,
+    engine="platypus",
+    items=None,
+    reproducible=False,
+    compress=False,
+    renderer=None,
+):
+    # Render an invoice with renderer (an AsyncInvoiceRenderer), by default
+    # one shared by the process and created on first use. Returns the PDF as
+    # bytes.
+    global _async_renderer
+    if renderer is None:
+        if _async_renderer is None:
+            _async_renderer = AsyncInvoiceRenderer()
+        renderer = _async_renderer
+    return await renderer.render(
+        config_file,
+        invoice_number,
+        date,
+        hours,
+        engine=engine,
+        items=items,
+        reproducible=reproducible,
+        compress=compress,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _server_classes():
+    # Return the request handler and Unix socket server classes used by serve,
+    # defined on first use so that only serve imports http.server
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+
+    class InvoiceRequestHandler(BaseHTTPRequestHandler):
+        # POST /render takes the parameters of main() as a JSON object
+        # ({"config", "number", "date" and "units" or "items"} and optionally
+        # "engine") and returns the PDF. GET /stats returns request counts and
+        # latency percentiles.
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, self.server.stats.summary())
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/render":
+                self._send_json(404, {"error": "Not found"})
+                return
+
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(length))
+                hours, items = _job_work(params)
+                args = (params["config"], params["number"], params["date"], hours)
+                engine = params.get("engine", self.server.engine)
+                if engine not in ENGINES:
+                    raise ValueError(f"Unknown rendering engine: {engine}")
+                # Bad configs and line items are the client's to fix too
+                line_items(load_profile(params["config"]), hours, items)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.server.stats.record(time.perf_counter() - start, ok=False)
+                self._send_json(
+                    400, {"error": f"Invalid request: {type(e).__name__}: {e}"}
+                )
+                return
+
+            try:
+                data = self.server.executor.submit(
+                    render_invoice, *args, output=None, engine=engine, items=items
+                ).result()
+            except Exception as e:
+                self.server.stats.record(time.perf_counter() - start, ok=False)
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header(
+                "Content-Disposition", f'inline; filename="invoice_{args[1]}.pdf"'
+            )
+            self.end_headers()
+            self.wfile.write(data)
+            self.server.stats.record(time.perf_counter() - start)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            # Unix domain socket clients have no address
+            return self.client_address[0] if self.client_address else "unix"
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return InvoiceRequestHandler, UnixHTTPServer
+
+
+def _warm_worker():
+    # Build the default theme, and load the layout fonts and their width
+    # tables by writing a throwaway PDF, up front so the first request doesn't
+    # pay for them
+    from reportlab.pdfgen import canvas
+
+    get_theme()
+    canv = canvas.Canvas(io.BytesIO(), pagesize=PAGE_SIZE)
+    for font_name in LAYOUT_FONTS:
+        text_width("£0.00", font_name, TABLE_FONT_SIZE)
+        canv.setFont(font_name, TABLE_FONT_SIZE)
+        canv.drawString(0, 0, "£0.00")
+    canv.getpdfdata()
+
+
+def _start_workers(executor, workers):
+    # Start every worker process of executor now, from this thread. Pools only
+    # fork their workers on the first submit, which would otherwise come from
+    # a request thread and make the first request pay for the start-up.
+    from concurrent.futures import wait
+
+    wait([executor.submit(_warm_worker) for _ in range(workers)])
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(
+    port=8000, host="127.0.0.1", socket_path=None, workers=None, engine="platypus"
+):
+    # Keep a pool of warm rendering processes behind an HTTP server listening
+    # on host:port, or on a Unix domain socket when socket_path is given
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=_mp_context(), initializer=_warm_worker
+    )
+    _start_workers(executor, workers)
+
+    from http.server import ThreadingHTTPServer
+
+    handler, unix_server = _server_classes()
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = unix_server(socket_path, handler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        address = f"http://{host}:{server.server_address[1]}"
+    server.executor = executor
+    server.stats = LatencyStats()
+    server.engine = engine
+
+    # Stop cleanly on SIGTERM as well as Ctrl-C
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    print(f"Serving invoices on {address} with {workers} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="invoice_generator.py serve",
+        description="Run a long-lived invoice rendering service.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument(
+        "--port", type=int, default=8000, help="HTTP port to listen on (default: 8000)"
+    )
+    parser.add_argument(
+        "--socket", help="Listen on this Unix domain socket instead of a TCP port"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of rendering processes (default: number of CPUs)",
+    )
     parser.add_argument(
-        "-c", "--config", required=True, help="Path to the configuration file"
+        "--engine",
+        choices=ENGINES,
+        default="platypus",
+        help="Default rendering engine (default: platypus)",
     )
-    parser.add_argument("-n", "--number", required=True, help="Invoice number")
-    parser.add_argument("-d", "--date", required=True, help="Date of the invoice")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    serve(args.port, args.host, args.socket, args.workers, args.engine)
+
+
+def ledger_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="invoice_generator.py ledger",
+        description="List invoices recorded in a ledger.",
+    )
+    parser.add_argument("path", help="Ledger database written with --ledger")
+    parser.add_argument("-n", "--number", help="Invoice number")
+    parser.add_argument("--client", help="Client name, as in the config")
+    parser.add_argument(
+        "--from", dest="start", metavar="DATE", help="Earliest invoice date"
+    )
+    parser.add_argument("--to", dest="end", metavar="DATE", help="Latest invoice date")
+    parser.add_argument("--currency", help="Currency code, e.g. GBP")
+    parser.add_argument(
+        "--json", action="store_true", help="Print the entries as JSON lines"
+    )
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} does not exist")
+
+    with InvoiceLedger(args.path) as ledger:
+        entries = ledger.find(
+            args.number, args.client, args.start, args.end, args.currency
+        )
+
+    totals = {}
+    for entry in entries:
+        if args.json:
+            print(json.dumps(entry._asdict()))
+            continue
+        amount = format_money(get_currency_symbol(entry.currency), entry.total)
+        print(f"{entry.number:<12} {entry.date:<12} {amount:>14}  {entry.client}")
+        totals[entry.currency] = totals.get(entry.currency, 0) + entry.total
+    if not args.json:
+        summary = ", ".join(
+            format_money(get_currency_symbol(currency), total)
+            for currency, total in sorted(totals.items())
+        )
+        print(f"{len(entries)} invoice{'s' if len(entries) != 1 else ''}", end="")
+        print(f", total {summary}" if summary else "")
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "serve":
+        serve_main(argv[1:])
+        return
+    if argv and argv[0] == "ledger":
+        ledger_main(argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Generate an invoice.",
+        epilog="Run 'invoice_generator.py serve --help' for the rendering service "
+        "and 'invoice_generator.py ledger --help' to look up recorded invoices.",
+    )
+
+    parser.add_argument("-c", "--config", help="Path to the configuration file")
+    parser.add_argument("-n", "--number", help="Invoice number")
+    parser.add_argument("-d", "--date", help="Date of the invoice")
     parser.add_argument(
         "-u",
         "--units",
         type=float,
-        required=True,
         help="Number of units (hours/days/weeks) worked",
     )
+    parser.add_argument(
+        "--items",
+        metavar="FILE",
+        help="JSON file listing the invoice's line items, each with units and "
+        "optionally description, rate and vat, instead of -u/--units",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="platypus",
+        help="Rendering engine; canvas draws the fixed layout directly and "
+        "falls back to platypus when content does not fit (default: platypus)",
+    )
+    parser.add_argument(
+        "--stdout",
+        action="store_true",
+        help="Write the PDF to standard output instead of invoice_<number>.pdf",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Generate every invoice listed in a JSONL manifest "
+        "(one object with config, number, date and units per line)",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Write batch invoices into a .zip, .tar, .tar.gz or .tgz archive "
+        "instead of individual files",
+    )
+    parser.add_argument(
+        "--clients",
+        metavar="FILE",
+        help="Read the --batch manifest as a timesheet CSV, looking up each "
+        "row's client in this JSON object of client ids and config files",
+    )
+    parser.add_argument(
+        "--pack",
+        metavar="PATH",
+        help="Render all batch invoices into this one PDF, one after another, "
+        "with a bookmark for each",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to render a batch (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=16,
+        help="Number of invoices sent to a worker at a time (default: 16)",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Report batch results as they complete instead of in manifest order",
+    )
+    parser.add_argument(
+        "--auto-number",
+        action="store_true",
+        help="Allocate the invoice number (or, with --batch, the number of "
+        "every entry without one) from a sequence shared between processes",
+    )
+    parser.add_argument(
+        "--sequence",
+        metavar="PATH",
+        default="invoice_sequence.db",
+        help="SQLite file holding the --auto-number sequence "
+        "(default: invoice_sequence.db)",
+    )
+    parser.add_argument(
+        "--number-format",
+        default=NUMBER_FORMAT,
+        help=f"Format of allocated numbers (default: {NUMBER_FORMAT})",
+    )
+    parser.add_argument(
+        "--number-block",
+        type=int,
+        default=NUMBER_BLOCK_SIZE,
+        help="Numbers a batch reserves at a time; the most a crashed run can "
+        f"skip (default: {NUMBER_BLOCK_SIZE})",
+    )
+    parser.add_argument(
+        "--ledger",
+        metavar="PATH",
+        help="Record generated invoices in this SQLite ledger, refusing invoice "
+        "numbers it already has",
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Make identical invoices byte-identical PDFs, with timestamps and "
+        "document IDs derived from the invoice instead of the time",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Write the smallest PDFs, with compressed binary content streams",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Copy invoices whose inputs have not changed from this render "
+        "cache instead of rendering them again",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=CACHE_MAX_BYTES / 2**20,
+        metavar="MB",
+        help=f"Largest size of the render cache (default: {CACHE_MAX_BYTES >> 20})",
+    )
+    parser.add_argument(
+        "--cache-age",
+        type=float,
+        default=CACHE_MAX_AGE / 86400,
+        metavar="DAYS",
+        help="Evict cached invoices unused for this long "
+        f"(default: {CACHE_MAX_AGE // 86400})",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Validate the config (or every batch entry) and print the amount "
+        "due without generating any PDF",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print wall and CPU time per rendering phase to standard error "
+        "(also enabled by setting INVOICE_TIMINGS=1)",
+    )
+    parser.add_argument(
+        "--timings-json",
+        metavar="PATH",
+        help="Write the per-phase timings as JSON to PATH",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_KINDS,
+        help="Profile the run with cProfile (cpu) or tracemalloc (mem), write "
+        "the results to --profile-out and print the top entries to standard "
+        "error",
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="PATH",
+        help="File for the --profile results (default: "
+        f"{PROFILE_FILES['cpu']} or {PROFILE_FILES['mem']})",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=PROFILE_TOP,
+        metavar="N",
+        help="Number of functions or allocation sites to print "
+        f"(default: {PROFILE_TOP})",
+    )
+
+    args = parser.parse_args(argv)
 
-    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.number_block < 1:
+        parser.error("--number-block must be at least 1")
+    if args.profile_top < 1:
+        parser.error("--profile-top must be at least 1")
+    if args.profile_out and not args.profile:
+        parser.error("--profile-out requires --profile")
+    if args.profile and args.workers > 1:
+        # Worker processes would escape the profile; one process runs the
+        # same rendering code
+        parser.error("--profile cannot be used with --workers")
 
-    generate_invoice(args.config, args.number, args.date, args.units)
+    if args.clients and not args.batch:
+        parser.error("--clients requires --batch")
+    if args.pack:
+        if not args.batch:
+            parser.error("--pack requires --batch")
+        for option, value in (
+            ("--archive", args.archive),
+            ("--auto-number", args.auto_number),
+            ("--cache", args.cache),
+            ("--dry-run", args.dry_run),
+            ("--workers", args.workers > 1),
+        ):
+            if value:
+                parser.error(f"--pack cannot be used with {option}")
+    if args.archive:
+        if not args.batch:
+            parser.error("--archive requires --batch")
+        if not args.archive.endswith((".zip", ".tar", ".tar.gz", ".tgz")):
+            parser.error("--archive must end in .zip, .tar, .tar.gz or .tgz")
+
+    # The table is printed unless --timings-json is the only thing asking
+    show_table = args.timings or os.environ.get(
+        "INVOICE_TIMINGS", ""
+    ).lower() not in ("", "0", "false", "no")
+    timings = None
+    if show_table or args.timings_json:
+        timings = enable_timings()
+    if args.profile:
+        profiler = profiling(args.profile, args.profile_out, args.profile_top)
+    else:
+        profiler = contextlib.nullcontext()
+    try:
+        with profiler:
+            _run_cli(parser, args)
+    finally:
+        if timings is not None and timings.phases:
+            report_timings(timings, show_table, args.timings_json)
+
+
+def report_timings(timings, table=True, json_path=None):
+    # Print the timing table to standard error and/or write JSON to json_path
+    if table:
+        print(timings.format_table(), file=sys.stderr)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(timings.as_dict(), f, indent=2)
+            f.write("\n")
+
+
+def _run_cli(parser, args):
+    if args.dry_run:
+        if args.stdout:
+            parser.error("--dry-run cannot be used with --stdout")
+        if args.archive:
+            parser.error("--dry-run cannot be used with --archive")
+        if args.ledger:
+            parser.error("--dry-run cannot be used with --ledger")
+        if args.cache:
+            parser.error("--dry-run cannot be used with --cache")
+    if args.ledger and args.stdout:
+        parser.error("--ledger cannot be used with --stdout")
+    if args.auto_number:
+        if args.number is not None:
+            parser.error("-n/--number cannot be used with --auto-number")
+        if args.dry_run:
+            parser.error("--dry-run cannot be used with --auto-number")
+
+    cache = None
+    if args.cache:
+        cache = RenderCache(
+            args.cache, int(args.cache_size * 2**20), args.cache_age * 86400
+        )
+    ledger = InvoiceLedger(args.ledger) if args.ledger else None
+    try:
+        _run_command(parser, args, ledger, cache)
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if cache is not None:
+            cache.evict()
+            print(cache.format_summary(), file=sys.stderr)
+
+
+def _generate_numbered(args, items, ledger, cache):
+    # A single invoice reserves just the one number, handing it back if the
+    # invoice cannot be written so the sequence stays free of gaps. Numbers
+    # already in the ledger are skipped and used up.
+    with InvoiceNumberSequence(args.sequence, block_size=1) as sequence:
+        number = _allocate_unrecorded(sequence, args.number_format, ledger)
+        try:
+            if args.stdout:
+                render_invoice(
+                    args.config,
+                    args.number_format.format(number),
+                    args.date,
+                    args.units,
+                    output=sys.stdout.buffer,
+                    engine=args.engine,
+                    items=items,
+                    cache=cache,
+                    reproducible=args.reproducible,
+                    compress=args.compress,
+                )
+                sys.stdout.buffer.flush()
+            else:
+                generate_invoice(
+                    args.config,
+                    args.number_format.format(number),
+                    args.date,
+                    args.units,
+                    engine=args.engine,
+                    items=items,
+                    ledger=ledger,
+                    cache=cache,
+                    reproducible=args.reproducible,
+                    compress=args.compress,
+                )
+        except DuplicateInvoiceError as e:
+            # Recorded by another process meanwhile, so used up
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        except BaseException:
+            sequence.release([number])
+            raise
+
+
+def _run_command(parser, args, ledger, cache):
+    if args.batch:
+        if args.stdout:
+            parser.error("--stdout cannot be used with --batch")
+        if args.items:
+            parser.error("--items cannot be used with --batch")
+        clients = None
+        if args.clients:
+            try:
+                clients = ClientTable(args.clients)
+                check_csv_columns(args.batch)
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+        if args.dry_run:
+            ok = check_batch(args.batch, clients)
+        elif args.pack:
+            ok = run_pack(
+                args.batch,
+                args.pack,
+                ledger=ledger,
+                clients=clients,
+                engine=args.engine,
+                reproducible=args.reproducible,
+                compress=args.compress,
+            )
+        else:
+            sequence = None
+            if args.auto_number:
+                sequence = InvoiceNumberSequence(args.sequence, args.number_block)
+            try:
+                ok = run_batch(
+                    args.batch,
+                    args.workers,
+                    args.chunk_size,
+                    ordered=not args.unordered,
+                    archive=args.archive,
+                    ledger=ledger,
+                    engine=args.engine,
+                    cache=cache,
+                    reproducible=args.reproducible,
+                    compress=args.compress,
+                    sequence=sequence,
+                    number_format=args.number_format,
+                    clients=clients,
+                )
+            finally:
+                if sequence is not None:
+                    sequence.close()
+        if not ok:
+            sys.exit(1)
+        return
+
+    missing = [
+        option
+        for option, value in (
+            ("-c/--config", args.config),
+            ("-n/--number", 0 if args.auto_number else args.number),
+            ("-d/--date", args.date),
+            ("-u/--units or --items", args.units if args.items is None else 0),
+        )
+        if value is None
+    ]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if args.items and args.units is not None:
+        parser.error("-u/--units cannot be used with --items")
+
+    if args.dry_run:
+        try:
+            items = load_items(args.items) if args.items else None
+            amount_due_text = check_invoice(
+                args.config, args.number, args.date, args.units, items
+            )
+        except Exception as e:
+            print(f"{args.config}: {type(e).__name__}: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"invoice_{args.number}.pdf: {amount_due_text}")
+        return
+
+    items = load_items(args.items) if args.items else None
+    if args.auto_number:
+        _generate_numbered(args, items, ledger, cache)
+        return
+    if args.stdout:
+        render_invoice(
+            args.config,
+            args.number,
+            args.date,
+            args.units,
+            output=sys.stdout.buffer,
+            engine=args.engine,
+            items=items,
+            cache=cache,
+            reproducible=args.reproducible,
+            compress=args.compress,
+        )
+        sys.stdout.buffer.flush()
+        return
+
+    try:
+        generate_invoice(
+            args.config,
+            args.number,
+            args.date,
+            args.units,
+            engine=args.engine,
+            items=items,
+            ledger=ledger,
+            cache=cache,
+            reproducible=args.reproducible,
+            compress=args.compress,
+        )
+    except DuplicateInvoiceError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":